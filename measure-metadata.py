@@ -35,7 +35,7 @@ def dump_sizedata(repo_paths, outfile="sizedata.json.gz"):
     sizedata = dict()
     valcount = defaultdict(Counter)
     for rpmfn in progress(iter_repo_rpms(repo_paths), itemfmt=rpm_basename):
-        r = rpmhdr(rpmfn)
+        r = rpmhdr(rpmfn, track_realsize=True)
         sizedata[r.envra] = [
                 [r.sig.size, r.hdr.size, r.payloadsize],
                 [(te.tag, te.offset, te.size, te.realsize)
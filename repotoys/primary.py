@@ -1,16 +1,27 @@
 # repotoys.primary - parse primary.xml
 
-import gzip
+import re
+from collections import deque
+from functools import lru_cache
 from xml.etree import ElementTree as ET
 from dataclasses import dataclass, field
 from typing import Any
-from binascii import unhexlify
+
+# python-isal's igzip is a drop-in replacement for gzip that decompresses
+# several times faster, so use it if it's available.
+try:
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
 
 # Some helpers for xmlns handling / tag comparison..
+@lru_cache(maxsize=None)
 def MD(tag):
     return ET.QName('http://linux.duke.edu/metadata/common',tag).text
+@lru_cache(maxsize=None)
 def RPM(tag):
     return ET.QName('http://linux.duke.edu/metadata/rpm',tag).text
+@lru_cache(maxsize=None)
 def FL(tag):
     return ET.QName('http://linux.duke.edu/metadata/filelists',tag).text
 
@@ -38,7 +49,7 @@ ET.register_namespace('',    'http://linux.duke.edu/metadata/common')
 ET.register_namespace('rpm', 'http://linux.duke.edu/metadata/rpm')
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class PackageElement:
     elem: Any = field(repr=False)
     name: str
@@ -55,62 +66,75 @@ class PackageElement:
     buildtime: int = field(repr=False)
     hdrsize: int = field(repr=False)
     mditems: int = field(repr=False)
-    # NOTE: calculating mdsize precisely takes an extra ~1ms per element,
-    # or ~10-20sec per repo -> ~3hrs for my dataset of ~800 metadata samples,
-    # so... it'll default to being None.
-    # mdsize correlates very closely with mditems, which is 100x faster to
-    # calculate, so you'll generally be fine using that instead.
+    # NOTE: mdsize is the size of the <package> element in the source file.
+    # Primary.iter_package_elem(mdsize=True) gets that from the source offsets
+    # for (nearly) free; if you've only got an element we have to serialize
+    # it to estimate the size, which takes an extra ~1ms per element.
+    # Either way it'll default to being None.
+    # mdsize correlates very closely with mditems, so you'll generally be
+    # fine using that instead.
     # (We can approximate mdsize by (mditems*62)+626 or (mditems*90).. or at
     # least that's what scipy.stats.linregress() etc. are telling me.)
     mdsize: int = field(repr=False, default=None)
 
-    @property
-    def nevra(self):
-        if self.epoch == 0:
-            return f'{self.name}-{self.version}-{self.release}.{self.arch}'
-        else:
-            return f'{self.name}-{self.epoch}:{self.version}-{self.release}.{self.arch}'
+    # These never change, so we just build them once in __post_init__
+    nevra: str = field(init=False, repr=False, compare=False)
+    envra: str = field(init=False, repr=False, compare=False)
 
-    @property
-    def envra(self):
+    def __post_init__(self):
         if self.epoch == 0:
-            return self.nevra
+            nevra = f'{self.name}-{self.version}-{self.release}.{self.arch}'
+            envra = nevra
         else:
-            return f'{self.epoch}:{self.name}-{self.version}-{self.release}.{self.arch}'
+            nevra = f'{self.name}-{self.epoch}:{self.version}-{self.release}.{self.arch}'
+            envra = f'{self.epoch}:{self.name}-{self.version}-{self.release}.{self.arch}'
+        # frozen dataclass, so we have to sneak past its __setattr__
+        object.__setattr__(self, 'nevra', nevra)
+        object.__setattr__(self, 'envra', envra)
 
     @staticmethod
     def find_pkgid(elem):
+        # The pkgid checksum is pretty much always the first (and only) one,
+        # so check that before we go searching through the rest.
+        ck = elem.find(MDTAG['checksum'])
+        if ck is not None and ck.get('pkgid') == 'YES':
+            return bytes.fromhex(ck.text)
         for ck in elem.iterfind(MDTAG['checksum']):
-            if ck.attrib.get('pkgid','') == 'YES':
-                return unhexlify(ck.text)
+            if ck.get('pkgid') == 'YES':
+                return bytes.fromhex(ck.text)
 
     @staticmethod
     def elem_mdsize(elem):
-        # FIXME: this is a goofy, snow, inefficient way to handle this.
-        # I'd rather just get the file offsets in _iterparse() but we can't
-        # be sure that fobj.tell() is correct and the parser doesn't otherwise
-        # tell us how much data it's read.
+        # NOTE: this is a goofy, slow, inefficient way to handle this, so it's
+        # only used when we don't have the source offsets for this element.
+        # See XMLMD._iterparse_sized().
 
         s = ET.tostring(elem)
         # Tweak size so it skips the xmlns stuff and extra spaces
         return len(s) - 93 - s.count(b' />')
 
     @staticmethod
-    def elem_mditems(elem):
-        return sum(1 for _ in elem.find(MDTAG['format']).iter('*')) - 1
+    def elem_mditems(elem, fmt=None):
+        # Count every element below <format>. Pass `fmt` if you've already
+        # got the <format> element handy, to skip the find().
+        if fmt is None:
+            fmt = elem.find(MDTAG['format'])
+        return len(list(fmt.iter())) - 1
 
 
     @classmethod
-    def from_elem(cls, e, mdsize=False, save_elem=False):
-        # NOTE: you'd think it'd be faster to manually iterate through the
-        # child tags exactly once rather than searching through them
-        # repeatedly, but that actually turns out to be slower. Weird, huh?
-        v = e.find(MDTAG['version'])
-        n = e.find(MDTAG['name'])
-        a = e.find(MDTAG['arch'])
-        s = e.find(MDTAG['size'])
-        t = e.find(MDTAG['time'])
-        h = e.find(f"{MDTAG['format']}/{RPMTAG['header-range']}")
+    def from_elem(cls, e, mdsize=False, save_elem=False, srcsize=None):
+        # NOTE: this used to do a separate find() for each child, because
+        # manually iterating through the children was slower. With current
+        # Python, one pass to index the children by tag is ~2x faster.
+        children = {c.tag:c for c in e}
+        v = children[MDTAG['version']]
+        n = children[MDTAG['name']]
+        a = children[MDTAG['arch']]
+        s = children[MDTAG['size']]
+        t = children[MDTAG['time']]
+        f = children[MDTAG['format']]
+        h = f.find(RPMTAG['header-range'])
         return cls(
             elem=e if save_elem else None,
             name=n.text,
@@ -124,11 +148,12 @@ class PackageElement:
             filetime=int(t.attrib['file']),
             buildtime=int(t.attrib['build']),
             hdrsize=int(h.attrib['end'])-int(h.attrib['start']),
-            mditems=PackageElement.elem_mditems(e),
-            mdsize=PackageElement.elem_mdsize(e) if mdsize else None,
+            mditems=PackageElement.elem_mditems(e, f),
+            mdsize=(srcsize if srcsize is not None else
+                    PackageElement.elem_mdsize(e) if mdsize else None),
         )
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class RPMEntryElement:
     name: str
     flags: str # FIXME: rpmtoys.DepFlags
@@ -136,7 +161,7 @@ class RPMEntryElement:
     ver: str # FIXME: rpmtoys.pkgtup?
     rel: str
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class RPMFormatElement:
     license: str
     vendor: str
@@ -153,7 +178,7 @@ class RPMFormatElement:
     supplements: [RPMEntryElement]
     enhances: [RPMEntryElement]
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class FilelistPackage:
     name: str
     epoch: str
@@ -161,7 +186,7 @@ class FilelistPackage:
     release: str
     arch: str
     pkgid: bytes = field(repr=False, compare=True)
-    fileitems = [(str, str)]
+    fileitems: ((str, str),) = field(repr=False)
 
     @property
     def dirs(self):
@@ -178,18 +203,36 @@ class FilelistPackage:
     @classmethod
     def from_elem(cls, e):
         if not (e.tag == FLTAG['package']):
-            raise ValueError("Invalid element tag {e.tag!r}")
-        v = e.find(MDTAG['version'])
-        fi = e.iterfind(FLTAG['file'])
-        return cls(name=e.attrib.get('name'),
-                   arch=e.attrib.get('arch'),
-                   epoch=int(v.attrib.get('epoch','0')),
-                   version=v.attrib.get('ver'),
-                   release=v.attrib.get('rel'),
-                   files=[(f.attrib.get('type',''), f.text) for f in fi],
+            raise ValueError(f"Invalid element tag {e.tag!r}")
+        v = e.find(FLTAG['version'])
+        # NOTE: for a whole repo this loop runs millions of times, and a plain
+        # scan over the children is ~15% faster than iterfind().
+        filetag = FLTAG['file']
+        return cls(name=e.get('name'),
+                   arch=e.get('arch'),
+                   epoch=int(v.get('epoch','0')),
+                   version=v.get('ver'),
+                   release=v.get('rel'),
+                   pkgid=bytes.fromhex(e.get('pkgid')),
+                   fileitems=tuple((f.get('type',''), f.text)
+                                   for f in e if f.tag == filetag),
                    )
 
 
+# The start/end of a document that we can wrap around raw <package> fragments
+# (see XMLMD._itersplit) so they can be parsed on their own.
+PKG_FRAGMENT_HEAD = (b'<metadata xmlns="http://linux.duke.edu/metadata/common"'
+                     b' xmlns:rpm="http://linux.duke.edu/metadata/rpm">')
+PKG_FRAGMENT_TAIL = b'</metadata>'
+
+def parse_package_fragments(frags, mdsize=False):
+    '''
+    Parse a list of raw <package> element sources from primary.xml and return
+    a list of PackageElements. This is what Primary's worker processes run.
+    '''
+    doc = ET.fromstring(PKG_FRAGMENT_HEAD + b''.join(frags) + PKG_FRAGMENT_TAIL)
+    return [PackageElement.from_elem(e, srcsize=len(f) if mdsize else None)
+            for e, f in zip(doc, frags)]
 
 
 class XMLMD(object):
@@ -200,13 +243,82 @@ class XMLMD(object):
         if self.name.endswith(".xml.gz"):
             return gzip.open(self.name)
         elif self.name.endswith(".xml"):
-            return open(self.name)
+            return open(self.name, 'rb')
         else:
             raise NotImplementedError("unhandled metadata filetype")
 
     def _iterparse(self, events=None):
+        # NOTE: clearing each element after we're done with it isn't enough;
+        # the root element still holds an (empty) child for every element
+        # we've already seen, which adds up fast for big repos. So we watch
+        # for the root element and drop its finished children as we go.
+        # NOTE: there's no expat buffer_text knob to turn here - the C
+        # XMLParser doesn't expose its expat parser, and its TreeBuilder
+        # already collects text fragments in C and joins them once per element.
+        events = events or ('end',)
+        with self._open() as fobj:
+            root = None
+            for event, elem in ET.iterparse(fobj, events=('start', 'end')):
+                if root is None:
+                    root = elem
+                if event in events:
+                    yield event, elem
+                if event == 'end' and elem is not root:
+                    del root[:]
+
+    def _itersplit(self, localname, blocksize=64*1024):
+        '''
+        Read the (uncompressed) metadata file and yield (chunk, start) pairs,
+        where each chunk ends just past a closing `localname` tag and
+        chunk[start:] is the complete source of that element. Joining all the
+        chunks gives you back the whole file; the last chunk is whatever's
+        left after the last element, and its `start` will be None.
+        '''
+        start_re = re.compile(b'<'+localname.encode('ascii')+rb'[\s/>]')
+        end_tag = b'</'+localname.encode('ascii')+b'>'
+        buf, pos = b'', 0
         with self._open() as fobj:
-            yield from ET.iterparse(fobj, events=events)
+            while True:
+                end = buf.find(end_tag, pos)
+                if end < 0:
+                    data = fobj.read(blocksize)
+                    if not data:
+                        break
+                    buf, pos = buf[pos:] + data, 0
+                    continue
+                end += len(end_tag)
+                start = start_re.search(buf, pos, end)
+                yield buf[pos:end], (start.start() - pos if start else None)
+                pos = end
+        yield buf[pos:], None
+
+    def _iterparse_sized(self, localname, blocksize=64*1024):
+        '''
+        Iteratively parse the metadata file, yielding (elem, size) for the
+        'end' event of each element named `localname`, where `size` is the
+        number of bytes the element takes up in the (uncompressed) source.
+
+        This works by splitting the data just past each closing tag before we
+        feed it to the parser, so we know exactly where each element starts
+        and ends in the source.
+        '''
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        sizes = deque()
+        root = None
+        for chunk, start in self._itersplit(localname, blocksize):
+            if start is not None:
+                sizes.append(len(chunk) - start)
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if root is None:
+                    root = elem
+                if event != 'end':
+                    continue
+                if elem.tag.rpartition('}')[2] == localname:
+                    yield elem, sizes.popleft()
+                if elem is not root:
+                    del root[:]
+        parser.close()
 
     def num_packages(self):
         for event, elem in self._iterparse(events=('start',)):
@@ -217,18 +329,55 @@ class XMLMD(object):
 class Primary(XMLMD):
     TOPLEVEL_TAG = MDTAG['package']
 
-    def iter_package_elem(self, mdsize=False):
+    def iter_package_elem(self, mdsize=False, workers=None, batchsize=256):
+        '''
+        Yield a PackageElement for each <package> in primary.xml.
+        If `workers` is set, the packages get parsed in batches of `batchsize`
+        by a pool of that many worker processes, but they're still yielded in
+        the same order as they appear in the file.
+        '''
+        if workers:
+            yield from self._iter_package_elem_pool(mdsize, workers, batchsize)
+            return
+        if mdsize:
+            for elem, size in self._iterparse_sized('package'):
+                yield PackageElement.from_elem(elem, srcsize=size)
+                elem.clear()
+            return
+        # NOTE: the parser doesn't hand back the same (interned) string
+        # objects we have in MDTAG, so we can't use `is` here; we can at least
+        # skip the dict lookup for each element, though.
+        pkgtag = MDTAG['package']
         for event, elem in self._iterparse(events=('end',)):
-            if elem.tag == MDTAG['package']:
-                yield PackageElement.from_elem(elem, mdsize=mdsize)
+            if elem.tag == pkgtag:
+                yield PackageElement.from_elem(elem)
                 elem.clear()
 
+    def _iter_package_elem_pool(self, mdsize, workers, batchsize):
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as pool:
+            pending = deque()
+            batch = []
+            for chunk, start in self._itersplit('package'):
+                if start is not None:
+                    batch.append(chunk[start:])
+                if len(batch) == batchsize or (batch and start is None):
+                    pending.append(pool.submit(parse_package_fragments,
+                                               batch, mdsize))
+                    batch = []
+                # Don't let the reader get too far ahead of the workers
+                while len(pending) > 2*workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
 class Filelists(XMLMD):
     TOPLEVEL_TAG = FLTAG['filelists']
 
     def iter_package_filelists(self):
+        pkgtag = FLTAG['package']
         for event, elem in self._iterparse(events=('end',)):
-            if elem.tag == FLTAG['package']:
+            if elem.tag == pkgtag:
                 yield FilelistPackage.from_elem(elem)
                 elem.clear()
 
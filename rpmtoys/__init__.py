@@ -2,15 +2,17 @@ from .hdr import rpmhdr, pkgtup
 from .tags import Tag, SigTag
 from .file import Attrs, VerifyAttrs
 from .deps import DepFlags, depinfo, deptypes, deptup
-from .repo import iter_repo_rpms
-from .digest import gethasher, digest
+from .repo import iter_repo_rpms, iter_repo_hdrs
+from .digest import gethasher, digest, hexdigest_blocks
 from .progress import progress
 
 __all__ = ['rpm', 'Tag', 'Attrs', 'VerifyAttrs', 'DepFlags', 'progress',
-           'iter_repo_rpms', 'pkgtup']
+           'iter_repo_rpms', 'iter_repo_hdrs', 'pkgtup']
 
+from array import array
 from collections import namedtuple, OrderedDict, Counter
-from itertools import zip_longest
+from functools import cached_property
+from itertools import repeat, zip_longest
 
 # (mode, ino, dev, username, groupname, size, mtime)
 # ..it's *close* to python's os.stat() output, at least.
@@ -45,6 +47,10 @@ extras = namedtuple("extras", extra_tags)
 extras._tags = extras(*extra_tags.values())
 
 class cpiohdr(namedtuple("cpiohdr", "name ino mode nlink mtime size dev rdev")):
+    __slots__ = ()
+    # "newc" header: 6-digit magic, then 13 8-digit hex fields
+    _fmt = b'%06x' + b'%08x'*13
+
     def _pack(self):
         magic = 0x070701
         name, ino, mode, nlink, mtime, size, dev, rdev = self
@@ -52,20 +58,68 @@ class cpiohdr(namedtuple("cpiohdr", "name ino mode nlink mtime size dev rdev")):
         rdevmaj, rdevmin = rdev >> 8, rdev & 0xff
         uid, gid = 0, 0
         check = 0
-        if name.startswith('/'):
-            name = '.'+name
-        name = name.rstrip('\0') + '\0'
-        hdr = (f'{magic:06x}{ino:08x}{mode:08x}{uid:08x}{gid:08x}{nlink:08x}'
-               f'{mtime:08x}{size:08x}{devmaj:08x}{devmin:08x}{rdevmaj:08x}'
-               f'{rdevmin:08x}{len(name):08x}{check:08x}{name}')
-        padto = (len(hdr)+3) & ~0x3
-        hdr += '\0'*(padto-len(hdr))
-        return bytes(hdr,'utf8')
+        name = name.encode('utf8')
+        if name.startswith(b'/'):
+            name = b'.'+name
+        name = name.rstrip(b'\0') + b'\0'
+        hdr = self._fmt % (magic, ino, mode, uid, gid, nlink, mtime, size,
+                           devmaj, devmin, rdevmaj, rdevmin, len(name), check)
+        hdr += name
+        return hdr + b'\0'*(-len(hdr) & 0x3)
 
     @classmethod
     def _trailer(cls):
         return cls('TRAILER!!!',0,0,1,0,0,0,0)
 
+def _readahead(iterable, maxsize=4):
+    '''
+    Iterate through `iterable` in a background thread, staying up to `maxsize`
+    items ahead of the caller. Useful when producing items (e.g. decompressing
+    the payload) drops the GIL, so it can overlap with whatever we're doing
+    with the items (e.g. hashing them).
+    '''
+    import threading
+    from queue import Queue, Full
+    q = Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        # don't block forever if the caller went away
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        it = iter(iterable)
+        try:
+            for item in it:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+        finally:
+            if hasattr(it, 'close'):
+                it.close()
+
+    t = threading.Thread(target=produce, daemon=True)
+    t.start()
+    try:
+        while True:
+            item, err = q.get()
+            if item is end:
+                if err is not None:
+                    raise err
+                return
+            yield item
+    finally:
+        stop.set()
+        t.join()
 
 # And here's the big fancy thing that holds all per-file RPM data
 rpmfile = namedtuple("rpmfile",
@@ -120,9 +174,24 @@ class rpm(rpmhdr):
         return self.hdr.tagent.get(tag).count if tag in self.hdr.tagent else 0
 
     def zipvals(self, *tags):
-        return tuple(zip_longest(*(self.getval(t,[]) for t in tags)))
+        getval = self.getval
+        return tuple(zip_longest(*[getval(t,[]) for t in tags]))
 
-    def buildtup(self):
+    def _cols(self, *tags):
+        '''
+        Return a tuple of the values of each of the given (per-file) tags.
+        Missing tags get a column of None, so zip(*cols) gives the same rows
+        as zipvals() but without the zip_longest overhead.
+        '''
+        getval = self.getval
+        vals = [getval(t) for t in tags]
+        n = max((len(v) for v in vals if v is not None), default=0)
+        return tuple((None,)*n if v is None else v for v in vals)
+
+    # The header doesn't change once it's parsed, so it's safe to cache
+    # things derived from it. (Just make sure they're immutable!)
+    @cached_property
+    def _buildtup(self):
         src = self.getval(Tag.SOURCERPM)
         if src is None:
             return None
@@ -131,9 +200,12 @@ class rpm(rpmhdr):
         return pkgtup.fromenvra(src)._replace(epoch=self.pkgtup.epoch,
                                               arch=self.pkgtup.arch)
 
+    def buildtup(self):
+        return self._buildtup
+
     srctup = buildtup
 
-    def digest(self, md5=True, sha1=True, sha256=True):
+    def digest(self, md5=True, sha1=True, sha256=True, threaded=False):
         '''
         Return digests of this RPM, as rpm would calculate them.
         Note that the MD5 covers the header and payload, while
@@ -141,8 +213,10 @@ class rpm(rpmhdr):
         contains digests for each file, so we can still verify the
         integrity of the _contents_ of the payload even if the
         payload itself changes (e.g. if we re-ordered files)
+        If `threaded` is True, reading and hashing happen in parallel.
         '''
-        return digest(self.name, md5=md5, sha1=sha1, sha256=sha256)
+        return digest(self, md5=md5, sha1=sha1, sha256=sha256,
+                      threaded=threaded)
 
     def _getsigdigests(self):
         from .tags import DIGEST_SIGTAGS
@@ -192,61 +266,135 @@ class rpm(rpmhdr):
         #   SigTag.PGP for header+payload
         raise NotImplementedError
 
-    def iterdigestfiles(self, algo=None):
+    def iterdigestfiles(self, algo=None, workers=None, readahead=False):
         '''
         Iterate through the payload files and calculate digests for each one.
         If `algo` is None, uses the algorithm in the rpm's FILEDIGESTALGO tag.
         Yields (name, hexdigest) pairs for each file in the payload.
+
+        If `workers` is set, files get hashed by a pool of that many threads
+        while we keep reading the payload. (hashlib drops the GIL while it
+        hashes, so this helps with bigger files.) Results are still yielded
+        in payload order.
+
+        If `readahead` is True, the payload gets decompressed in a separate
+        thread, a few files ahead of the hashing.
         '''
         if algo is None:
             algo = self.hdr.getval(Tag.FILEDIGESTALGO)
+        if workers:
+            yield from self._iterdigestfiles_pool(algo, workers)
+            return
+        if readahead:
+            files = _readahead((e.name[1:], list(e.get_blocks()))
+                               for e in self.payload_iter() if e.isreg)
+            for name, blocks in files:
+                yield (name, hexdigest_blocks(algo, blocks))
+            return
         for e in self.payload_iter():
             # TODO: if we can also get the raw headers, we could calculate
             # PAYLOADDIGESTALT at the same time..
             if e.isreg:
-                h = gethasher(algo)
-                for block in e.get_blocks():
-                    h.update(block)
-                yield (e.name[1:], h.hexdigest())
+                yield (e.name[1:], hexdigest_blocks(algo, e.get_blocks()))
+
+    def _iterdigestfiles_pool(self, algo, workers):
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            pending = deque()
+            for e in self.payload_iter():
+                if e.isreg:
+                    # The blocks have to be read before we move on to the
+                    # next entry, but the hashing can happen whenever.
+                    blocks = list(e.get_blocks())
+                    pending.append((e.name[1:],
+                                    pool.submit(hexdigest_blocks, algo, blocks)))
+                # Don't let the reader get too far ahead of the hashers
+                while len(pending) > 2*workers:
+                    name, fut = pending.popleft()
+                    yield (name, fut.result())
+            while pending:
+                name, fut = pending.popleft()
+                yield (name, fut.result())
+
+    def itercheckfiledigests(self):
+        '''
+        Yield (name, ok) for each file in the payload as soon as it has been
+        hashed, so callers can bail out early if they like.
+        '''
+        # NOTE: match by name, not position: the payload skips %ghost files
+        dig = dict(zip(self._files, self.getval(Tag.FILEDIGESTS, [])))
+        for n, d in self.iterdigestfiles():
+            yield n, dig.get(n) == d
 
-    def checkfiledigests(self):
+    def checkfiledigests(self, stop_on_fail=False):
         '''
         The RPM hdr can also contain the FILEDIGESTS tag, which will have
         digests of each file in the payload. The digest algorithm is specified
         by the FILEDIGESTALGO tag.
+        If `stop_on_fail` is True, stop checking at the first mismatch.
         '''
-        dig = dict(zip(self.iterfiles(), self.getval(Tag.FILEDIGESTS)))
-        return {n:dig.get(n)==d for n,d in self.iterdigestfiles()}
+        result = dict()
+        for n, ok in self.itercheckfiledigests():
+            result[n] = ok
+            if stop_on_fail and not ok:
+                break
+        return result
+
+    @cached_property
+    def _nfiles(self):
+        return self.getcount(Tag.BASENAMES)
 
     def nfiles(self):
         '''Return a count of the number of files in the package.'''
-        return self.getcount(Tag.BASENAMES)
+        return self._nfiles
+
+    # NOTE: The simple per-file iterators below just hand back an iterator
+    # over the underlying column rather than being generators themselves;
+    # that skips a generator frame per item, which adds up when
+    # iterfileinfo() is zipping nine of them together.
 
     def iterfiles(self):
         '''Yield each of the (complete) filenames in this RPM.'''
-        # NOTE: we don't use "getval" here because filenames are _always_
-        # encoded in UTF-8, regardless of the package encoding. In theory.
-        dirnames = self.hdr.tagval.get(Tag.DIRNAMES)
-        dirindexes = self.hdr.tagval.get(Tag.DIRINDEXES,[])
-        basenames = self.hdr.tagval.get(Tag.BASENAMES,[])
-        for diridx, basename in zip(dirindexes, basenames):
-            yield (dirnames[diridx]+basename).decode('utf-8')
+        return iter(self._files)
 
     def iterdigests(self):
         '''Yield each of the file digests if FILEDIGESTS is present'''
-        yield from self.getval(Tag.FILEDIGESTS, [])
+        return iter(self.getval(Tag.FILEDIGESTS, []))
 
+    def _intcolumn(self, tag):
+        # A compact array.array of the raw values, straight from the store,
+        # without unpacking (and keeping) a tuple of int objects.
+        if tag not in self.hdr.tagent:
+            return array('I')
+        return self.hdr.intarray(tag)
+
+    def flags_column(self):
+        '''Return the raw FILEFLAGS values, for bulk bitmask tests.'''
+        return self._intcolumn(Tag.FILEFLAGS)
+
+    def verifyflags_column(self):
+        '''Return the raw FILEVERIFYFLAGS values, for bulk bitmask tests.'''
+        return self._intcolumn(Tag.FILEVERIFYFLAGS)
+
+    # Making IntFlag objects is slow, but most files share a handful of
+    # distinct flag values, so only make one per distinct value.
     def iterflags(self):
-        yield from map(Attrs, self.getval(Tag.FILEFLAGS, []))
+        flags = self.getval(Tag.FILEFLAGS, [])
+        return map({f:Attrs(f) for f in set(flags)}.__getitem__, flags)
 
     def iterverifyflags(self):
-        yield from map(VerifyAttrs, self.getval(Tag.FILEVERIFYFLAGS, []))
+        flags = self.getval(Tag.FILEVERIFYFLAGS, [])
+        return map({f:VerifyAttrs(f) for f in set(flags)}.__getitem__, flags)
+
+    def fclasses(self):
+        '''Return a list of the file "class" for each file in this RPM.'''
+        classdict = self.getval(Tag.CLASSDICT, ())
+        return list(map(classdict.__getitem__, self.getval(Tag.FILECLASS,[])))
 
     def iterfclass(self):
         '''Yield the file "class" for each file in this RPM.'''
-        classdict = self.getval(Tag.CLASSDICT)
-        for idx in self.getval(Tag.FILECLASS,[]):
-            yield classdict[idx]
+        return iter(self.fclasses())
 
     def iterfiledeps(self):
         '''
@@ -254,30 +402,59 @@ class rpm(rpmhdr):
         Each item is a list of (depchar, idx) pairs that correspond to the
         dependency type and an index in that dependency list.
         '''
-        dependsdict = self.getval(Tag.DEPENDSDICT,[])
-        for x, n in self.zipvals(Tag.FILEDEPENDSX, Tag.FILEDEPENDSN):
-            # This is pretty gross right here, RPM...
-            yield [(chr(d >> 24), d & 0x00ffffff) for d in dependsdict[x:x+n]]
+        # This is pretty gross right here, RPM...
+        # Files share DEPENDSDICT entries, so decode each entry just once.
+        depends = [(chr(d >> 24), d & 0x00ffffff)
+                   for d in self.getval(Tag.DEPENDSDICT,[])]
+        for x, n in zip(*self._cols(Tag.FILEDEPENDSX, Tag.FILEDEPENDSN)):
+            yield depends[x:x+n]
+
+    def fstat_columns(self):
+        '''
+        Return the per-file stat info as columns: {'mode': [...], ...}.
+        Handy for aggregate queries (total size, newest mtime, etc.) since
+        it doesn't build a tuple for every file.
+        '''
+        return dict(zip(rpmstat._fields, map(list, self._cols(*rpmstat._tags))))
 
     def iterfstat(self):
-        for s in self.zipvals(*rpmstat._tags):
-            yield rpmstat(*s)
+        return map(rpmstat._make, zip(*self._cols(*rpmstat._tags)))
 
-    def iternlink(self):
+    @cached_property
+    def _nlinks(self):
         # It's super cool how RPM doesn't actually use FILENLINKS so we have to
         # figure out what files are actually hardlinks by making two passes
         # through FILEINODES
         inodes = self.getval(Tag.FILEINODES, [])
-        nlinks = Counter(inodes)
-        for ino in inodes:
-            yield nlinks[ino]
+        # Most packages don't have any hardlinks at all, and checking for
+        # that with a set is ~3x faster than counting everything.
+        if len(set(inodes)) == len(inodes):
+            return (1,) * len(inodes)
+        # RPM numbers inodes sequentially from 1, so a flat list of counts
+        # indexed by inode (a la bincount) is usually cheaper than hashing.
+        top = max(inodes)
+        if top < 10*len(inodes):
+            counts = [0] * (top+1)
+            for i in inodes:
+                counts[i] += 1
+        else:
+            counts = Counter(inodes)
+        return tuple(map(counts.__getitem__, inodes))
+
+    def iternlink(self):
+        return iter(self._nlinks)
 
     def iterfextras(self):
-        for ex in self.zipvals(*extras._tags):
-            yield {k:v for k,v in zip(extras._fields, ex) if v}
+        cols = self._cols(*extras._tags)
+        # Most of these are empty for most packages, so skip those columns
+        keep = [(k, col) for k, col in zip(extras._fields, cols) if any(col)]
+        keys = tuple(k for k, _ in keep)
+        rows = zip(*(col for _, col in keep)) if keep else repeat((), len(cols[0]))
+        for ex in rows:
+            yield {k:v for k,v in zip(keys, ex) if v}
 
     def iterlinktos(self):
-        yield from self.getval(Tag.FILELINKTOS, [])
+        return iter(self.getval(Tag.FILELINKTOS, []))
 
     rpmfileiter = dict(
         name=iterfiles,
@@ -300,40 +477,62 @@ class rpm(rpmhdr):
         '''
         # Possibly unnecessary shortcut..
         if self.nfiles() == 0:
-            yield from []
+            return
         if "all" in what:
             what = self.rpmfileiter.keys()
         yield from zip_longest(*(self.rpmfileiter[k](self) for k in what))
 
+    def fileinfo_columns(self, what=("all",)):
+        '''
+        Return a dict of lists, one for each rpmfile field listed in `what`,
+        with one item per file in the RPM. This skips building a tuple for
+        each file, which is much cheaper if you only need a couple of fields.
+        '''
+        if "all" in what:
+            what = self.rpmfileiter.keys()
+        return {k:list(self.rpmfileiter[k](self)) for k in what}
+
     def iterrpmfiles(self):
         '''
         Return an iterator that yields rpmfile (q.v.) objects corresponding to
         each file listed in the RPM header.
         '''
-        yield from (rpmfile(*f) for f in self.iterfileinfo(what=rpmfile._fields))
+        yield from map(rpmfile._make, self.iterfileinfo(what=rpmfile._fields))
 
     def itercpiohdrs(self, usedev=False):
-        for i in zip(self.iterfiles(),
-                     self.getval(Tag.FILEINODES),
-                     self.getval(Tag.FILEMODES),
-                     self.iternlink(),
-                     self.getval(Tag.FILEMTIMES),
-                     self.getval(Tag.FILESIZES),
-                     self.getval(Tag.FILEDEVICES) if usedev else [0]*self.nfiles(),
-                     self.getval(Tag.FILERDEVS)):
-            yield cpiohdr._make(i)
+        ino, mode, mtime, size, dev, rdev = self._cols(
+            Tag.FILEINODES, Tag.FILEMODES, Tag.FILEMTIMES, Tag.FILESIZES,
+            Tag.FILEDEVICES, Tag.FILERDEVS)
+        yield from map(cpiohdr._make,
+                       zip(self._files, ino, mode, self._nlinks, mtime, size,
+                           dev if usedev else repeat(0), rdev))
+
+    @cached_property
+    def _depnames(self):
+        return tuple(d.name for d in deptypes if self.getcount(d.nametag))
 
     def depnames(self):
-        return [d.name for d in deptypes if self.getcount(d.nametag)]
+        return list(self._depnames)
 
     def iterdeps(self, name):
         dep = depinfo[name]
         deptags = (dep.nametag, dep.flagtag, dep.vertag, dep.idxtag)
-        for n, f, v, i in self.zipvals(*deptags):
-            yield deptup(n, DepFlags(f), v, i)
+        names, flags, vers, idxs = self._cols(*deptags)
+        # like iterflags: only make one DepFlags per distinct value
+        flags = map({f:DepFlags(f) for f in set(flags)}.__getitem__, flags)
+        for n, f, v, i in zip(names, flags, vers, idxs):
+            yield deptup(n, f, v, i)
+
+    def dep_flag_column(self, name):
+        '''Return the raw flag values for the given dependency type.'''
+        return self._intcolumn(depinfo[name].flagtag)
 
     def getdeps(self, name):
         return list(self.iterdeps(name))
 
+    @cached_property
+    def _alldeps(self):
+        return {name:tuple(self.iterdeps(name)) for name in self._depnames}
+
     def alldeps(self):
-        return {name:self.getdeps(name) for name in self.depnames()}
+        return {name:list(deps) for name, deps in self._alldeps.items()}
@@ -26,7 +26,16 @@ deptypes = [
 depinfo = {ident:d for d in deptypes for ident in (d.name, d.char)}
 char2name = {d.char:d.name for d in deptypes if d.char != '?'}
 
+# Same as char2name, but indexed by ord(char) - e.g. for the raw
+# (DEPENDSDICT entry >> 24) values - so lookups don't need chr() or hashing.
+ord2name = [None]*128
+for _c, _n in char2name.items():
+    ord2name[ord(_c)] = _n
+ord2name = tuple(ord2name)
+del _c, _n
+
 class deptup(namedtuple("deptup", "name flags version index")):
+    __slots__ = ()
     @property
     def is_rich(self):
         return self.name.startswith('(')
@@ -108,3 +117,12 @@ class DepFlags(IntFlag):
 
     SENSEMASK = UNUSED_SERIAL | LESS | GREATER | EQUAL
     TRIGGER = TRIGGERPREIN | TRIGGERIN | TRIGGERUN | TRIGGERPOSTUN
+
+# Plain-int versions of the commonly-tested masks, for checking raw flag
+# values (e.g. from rpm.dep_flag_column()) without any IntFlag overhead.
+DEP_SENSE_MASK   = int(DepFlags.SENSEMASK)
+DEP_TRIGGER_MASK = int(DepFlags.TRIGGER)
+DEP_SCRIPT_MASK  = int(DepFlags.SCRIPT_PRE | DepFlags.SCRIPT_POST |
+                       DepFlags.SCRIPT_PREUN | DepFlags.SCRIPT_POSTUN |
+                       DepFlags.SCRIPT_VERIFY)
+DEP_AUTO_MASK    = int(DepFlags.FIND_REQUIRES | DepFlags.FIND_PROVIDES)
@@ -1,8 +1,12 @@
 # rpmtoys.digest - stuff for verifying package digest/hashes
 
+import os
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from enum import IntEnum
 from .hdr import rpmhdr
+from .tags import Tag, SigTag
 
 # See rpm/rpmio/rpmpgp.h:pgpPubkeyAlgo_e
 class HashAlgo(IntEnum):
@@ -48,11 +52,28 @@ HashSize = [0,
             28,
 ]
 
+# hashlib's named constructors are backed by OpenSSL, which already picks
+# SHA-NI / ARMv8 SHA2 code paths at runtime when the CPU has them (~1.3GB/s
+# for SHA256 here, vs. ~400MB/s for plain C), so there's no point in bringing
+# our own accelerated backend. We do skip hashlib.new()'s name lookup, though,
+# since that roughly doubles the cost of making a new hasher.
+_hashers = {name:getattr(hashlib, name) for name in
+            ('md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512')}
+
 def gethasher(algo):
     if isinstance(algo, int):
         algo = HashName[algo]
+    if algo in _hashers:
+        return _hashers[algo]()
     return hashlib.new(algo)
 
+def hexdigest_blocks(algo, blocks):
+    '''Return the hexdigest of the given blocks of data, using `algo`.'''
+    h = gethasher(algo)
+    for block in blocks:
+        h.update(block)
+    return h.hexdigest()
+
 def hashsize(algo):
     if isinstance(algo, int):
         return HashSize[algo]
@@ -121,50 +142,125 @@ class PayloadDigestVerifier(RPMVerifier):
         self.result = self.context.hexdigest()
         self.done = True
 
+class MultiHdrVerifier(RPMVerifier):
+    '''
+    Verify several header-only digests (e.g. sha1 and sha256) at once, so
+    the header bytes only get read once no matter how many we're checking.
+    result/expected are dicts of {'SHA1':..., 'SHA256':...}.
+    '''
+    def __init__(self, names=('sha1', 'sha256')):
+        super().__init__()
+        self.contexts = {name.upper():gethasher(name) for name in names}
+    def start(self, rpm):
+        self.expected = {name:rpm.sig.getval(SigTag[name])
+                         for name in self.contexts}
+    def update_hdr(self, data):
+        for h in self.contexts.values():
+            h.update(data)
+    def finish_hdr(self):
+        self.result = {name:h.hexdigest() for name,h in self.contexts.items()}
+        self.done = True
+
 verifiers = {
     'md5':MD5Verifier,
     'sha1':SHA1Verifier,
     'sha256':SHA256Verifier,
     'payloaddigest':PayloadDigestVerifier,
+    'hdr':MultiHdrVerifier,
 }
 
-# TODO: multithread
-# TODO: will probably end up refactoring..
-def digest(rpmfn, md5=True, sha1=True, sha256=True):
+# Read this much at a time when hashing package data
+DIGEST_BUFSIZE = 1 << 20
+
+def _iterchunks(fobj, size=-1, bufsize=DIGEST_BUFSIZE):
+    '''
+    Yield chunks of up to `size` bytes (or everything, if size < 0).
+
+    The chunks are memoryviews into a pair of reused buffers, which saves
+    allocating a new bytes object for every read. Each chunk is only valid
+    until the one after next is read - two buffers so the next chunk can be
+    read while the current one is still being hashed.
+    '''
+    if size > 0:
+        bufsize = min(bufsize, size)
+    bufs = [memoryview(bytearray(bufsize)) for _ in range(2)]
+    which = 0
+    while size:
+        buf = bufs[which]
+        if 0 < size < bufsize:
+            buf = buf[:size]
+        n = fobj.readinto(buf)
+        if not n:
+            break
+        if size > 0:
+            size -= n
+        yield buf[:n]
+        which ^= 1
+
+def _hash_stream(fobj, hashers, size=-1, bufsize=DIGEST_BUFSIZE, pool=None):
+    '''
+    Read `size` bytes (or everything, if size < 0) from fobj, a chunk at a
+    time, and feed each chunk to every one of the given hashers.
 
+    If `pool` (a ThreadPoolExecutor with at least len(hashers) workers) is
+    given, the next chunk gets read while the current one is being hashed,
+    and the hashers all run at once. hashlib releases the GIL while it's
+    hashing big buffers, so this can actually use multiple cores.
+    '''
+    chunks = _iterchunks(fobj, size, bufsize)
+    updates = [h.update for h in hashers]
+    if pool is None:
+        for buf in chunks:
+            for update in updates:
+                update(buf)
+        return
+    first, rest = updates[0], updates[1:]
+    nextbuf = pool.submit(next, chunks, None)
+    while True:
+        buf = nextbuf.result()
+        if buf is None:
+            break
+        nextbuf = pool.submit(next, chunks, None)
+        others = [pool.submit(update, buf) for update in rest]
+        first(buf)
+        for f in others:
+            f.result()
+
+# TODO: will probably end up refactoring..
+def digest(rpmfn, md5=True, sha1=True, sha256=True, threaded=False):
+    '''
+    Calculate the sig header digests for the given RPM, reading the header
+    (and payload, for md5) exactly once. `rpmfn` can be a filename or an
+    already-parsed rpmhdr, which saves re-parsing the headers.
+    '''
     if not (md5 or sha1 or sha256):
         return {}
 
-    digests = dict()
-
+    hdrv = MultiHdrVerifier([n for n,on in (('sha1', sha1),
+                                           ('sha256', sha256)) if on])
+    hashers = list(hdrv.contexts.values())
     if md5:
-        md5 = hashlib.md5()
-    if sha1:
-        sha1 = hashlib.sha1()
-    if sha256:
-        sha256 = hashlib.sha256()
+        md5 = gethasher('md5')
+        hashers.append(md5)
 
-    r = rpmhdr(rpmfn)
+    r = rpmfn if isinstance(rpmfn, rpmhdr) else rpmhdr(rpmfn)
 
-    with open(rpmfn, 'rb') as fobj:
-        # skip lead + sig
-        fobj.seek(r.lead._struct.size + r.sig.size)
+    with open(r.name, 'rb') as fobj, \
+         (ThreadPoolExecutor(3) if threaded else nullcontext()) as pool:
+        # we're going to read the whole thing start to finish
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fobj.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # skip lead + sig (including the sig's padding)
+        fobj.seek(r.lead._struct.size + r.sig.size + r.sig.padsize)
         # hash the header
-        # TODO: buffered io?
-        hdr = fobj.read(r.hdr.size)
-        for h in (md5, sha1, sha256):
-            if h:
-                h.update(hdr)
+        _hash_stream(fobj, hashers, r.hdr.size, pool=pool)
         # sha1 and sha256 just cover the header
-        if sha1:
-            digests['SHA1'] = sha1.hexdigest()
-        if sha256:
-            digests['SHA256'] = sha256.hexdigest()
+        hdrv.finish_hdr()
+        digests = hdrv.result
 
         # md5 also covers payload, and is binary
         if md5:
-            # TODO: buffered io?
-            md5.update(fobj.read())
+            _hash_stream(fobj, [md5], pool=pool)
             digests['MD5'] = md5.digest()
 
     return digests
@@ -47,3 +47,10 @@ class VerifyAttrs(IntFlag):
 
     FLAGMASK = (FILEDIGEST | FILESIZE | LINKTO | USER | GROUP | MTIME | MODE |
                 RDEV | CAPS | CONTEXTS | FAILURES)
+
+# Plain-int versions of the commonly-tested bits, for checking raw flag
+# values (e.g. from rpm.flags_column()) without any IntFlag overhead.
+ATTRS_CONFIG  = int(Attrs.CONFIG)
+ATTRS_DOC     = int(Attrs.DOC)
+ATTRS_GHOST   = int(Attrs.GHOST)
+ATTRS_LICENSE = int(Attrs.LICENSE)
@@ -17,9 +17,13 @@
 #
 # Author: Will Woods <wwoods@redhat.com>
 
-import os
+import sys
+import mmap
 import struct
-from collections import Counter, namedtuple, OrderedDict
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import cache, cached_property, lru_cache
 from io import BytesIO
 
 # These are sets of (integer) tag numbers that let us figure out whether a
@@ -30,6 +34,12 @@ from io import BytesIO
 # (MD5 and GPG). So we have to have different lookup tables. Thanks, RPM.
 from .tags import SCALAR_TAGS, BIN_TAGS, SIG_BIN_TAGS
 
+# Those are sets of Tag/SigTag enum members; we check plain ints against them
+# for every tag we parse, so keep frozen copies of the plain int values.
+_SCALAR_TAGS = frozenset(map(int, SCALAR_TAGS))
+_BIN_TAGS = frozenset(map(int, BIN_TAGS))
+_SIG_BIN_TAGS = frozenset(map(int, SIG_BIN_TAGS))
+
 # --- Okay, here's some machinery to parse an RPM by hand.
 # --- For more info about the header data format, see:
 # ---   http://ftp.rpm.org/max-rpm/s1-rpm-file-format-rpm-file-format.html
@@ -37,6 +47,7 @@ from .tags import SCALAR_TAGS, BIN_TAGS, SIG_BIN_TAGS
 
 # Obsolete "Lead" structure
 class rpmlead(namedtuple('rpmlead', 'magic major minor type arch name os sig res')):
+    __slots__ = ()
     _struct = struct.Struct("! 4s B B h h 66s h h 16s")
     @classmethod
     def _unpack(cls, data):
@@ -48,31 +59,79 @@ class rpmlead(namedtuple('rpmlead', 'magic major minor type arch name os sig res
         return self._struct.pack(*self)
 
 
+# Section header, index entries, and region trailers. (Trailers are like
+# index entries, but the offset is signed - and negative.)
+hdr_s = struct.Struct("! 4L")
+idx_s = struct.Struct("! 4L")
+trailer_s = struct.Struct("! L L l L")
+
 # Read an RPM "Header Section Header" and return (tags, store):
 #   tags: list of (tag, offset, tagtype, count) tuples
 #   store: `bytes`, the "data store" for this section's values.
 def read_section_header(fobj, pad=False):
-    hdr_s = struct.Struct("! 4L")
-    idx_s = struct.Struct("! 4L")
     magic, reserved, icount, dsize = hdr_s.unpack(fobj.read(hdr_s.size))
     tags = tuple(idx_s.iter_unpack(fobj.read(icount*idx_s.size)))
     store = fobj.read(dsize)
-    if pad and dsize % 8:
-        fobj.read(8 - (dsize % 8))
+    if pad:
+        # skip to the next 8-byte boundary
+        fobj.read(-dsize & 7)
     return tags, store
 
 
 # "unpack" C-style (NUL-terminated) strings from the data store.
 def iter_unpack_c_string(store, offset, count=1):
     start = offset
-    end = len(store)
-    n = offset
-    while count and n < end:
-        if store[n] == 0:
-            yield store[start:n]
-            start = n+1
-            count -= 1
-        n += 1
+    find = store.find
+    while count:
+        end = find(b'\0', start)
+        if end < 0:
+            return
+        yield store[start:end]
+        start = end+1
+        count -= 1
+
+
+# Unpack `count` C-style strings starting at `offset`, and return them along
+# with the number of bytes they take up (including the NULs).
+def unpack_c_strings(store, offset, count):
+    end = offset
+    find = store.find
+    for _ in range(count):
+        nul = find(b'\0', end)
+        if nul < 0:
+            break
+        end = nul+1
+    if end == offset:
+        return (), 0
+    return tuple(store[offset:end-1].split(b'\0')), end-offset
+
+
+# Mark the byte range [lo,hi) as used and return how many of those bytes
+# weren't already used. `starts` and `ends` are parallel sorted lists that
+# describe the (non-overlapping, non-adjacent) ranges used so far, so this is
+# O(log n) in the number of ranges rather than O(n) in the number of bytes.
+def _claim_range(starts, ends, lo, hi):
+    if lo >= hi:
+        return 0
+    size = hi - lo
+    # Values are mostly laid out in order with no overlap, so the usual case
+    # is a new range past the end of everything we've seen so far.
+    if not ends or lo > ends[-1]:
+        starts.append(lo)
+        ends.append(hi)
+        return size
+    # starts[i:j]/ends[i:j] are the ranges that overlap or touch [lo,hi)
+    i = bisect_left(ends, lo)
+    j = bisect_right(starts, hi)
+    overlap = 0
+    for s, e in zip(starts[i:j], ends[i:j]):
+        overlap += max(0, min(e, hi) - max(s, lo))
+    # merge them all into one range
+    if i < j:
+        lo, hi = min(lo, starts[i]), max(hi, ends[j-1])
+    starts[i:j] = [lo]
+    ends[i:j] = [hi]
+    return size - overlap
 
 
 # Run through the section's "tags", parse the corresponding values, and
@@ -84,59 +143,115 @@ def iter_unpack_c_string(store, offset, count=1):
 #  size: `int` length of the value data, in bytes
 #  realsize: `int` count of bytes of the value that do _not_ overlap other
 #            values. (The first value will have size == realsize).
+#            Only calculated if track_realsize is True; otherwise it's the
+#            same as size.
 #  val: the actual parsed data. the type depends on the tag, but should be
 #       one of `int`, `[int]`, `str`, `[str]`, `bytes`.
 #       NOTE: we actually get `bytes` for `str`, and we _could_ decode() them
 #             using the value of tag 5062 (ENCODING), buuuut the official
 #             rpm-python module doesn't bother, so we'll sort that out later
-fmt_type_char = 'xCBHIL'
-def iter_parse_tags(tags, store): # noqa: C901
-    used = Counter()
-    i18ncnt = 1
+
+# struct format chars for the integer types: CHAR, INT8, INT16, INT32, INT64.
+# (NOTE: in '!' mode 'L' is only 4 bytes, so INT64 has to be 'Q'.)
+fmt_type_char = 'xBBHIQ'
+
+# array.array typecodes for the integer types
+array_type_char = 'xBBHIQ'
+
+# Lots of tags share the same (type, count) - e.g. every per-file int array in
+# a package - so keep the compiled Structs around.
+@lru_cache(maxsize=256)
+def _int_struct(typ, cnt):
+    return struct.Struct('!'+str(cnt)+fmt_type_char[typ])
+
+# Placeholder for a value that hasn't been unpacked yet (see TagValues)
+class LazyVal(object):
+    __slots__ = ('unpack', 'args')
+    def __init__(self, unpack, *args):
+        self.unpack = unpack
+        self.args = args
+    def __call__(self):
+        return self.unpack(*self.args)
+
+# Integer arrays bigger than this get unpacked lazily, if requested.
+# (Keep it >= 1 so SCALAR tags still get unpacked to a single value.)
+LAZY_MIN_COUNT = 16
+
+# If `lazy` is True, big integer arrays are yielded as LazyVal objects, which
+# can be called to get the actual value.
+def iter_parse_tags(tags, store, track_realsize=False, lazy=False): # noqa: C901
+    used_starts, used_ends = [], []
+    # HEADERI18NTABLE's 'cnt' is the real 'cnt' value for all values of
+    # type 9. See the note about RPM_I18NSTRING_TYPE in the LSB docs.
+    i18ncnt = next((cnt for tag, typ, off, cnt in tags if tag == 100), 1)
     for tag, typ, off, cnt in tags:
-        if tag == 100:
-            # this will be the real 'cnt' value for all values of type 9.
-            # See the note about RPM_I18NSTRING_TYPE in the LSB docs.
-            i18ncnt = cnt
         # NULL type
         if typ == 0:
             val = None
             size = 0
         # integer types
         elif typ <= 5:
-            fmt = '!'+str(cnt)+fmt_type_char[typ]
-            val = struct.unpack_from(fmt, store, off)
-            if cnt == 1 and tag in SCALAR_TAGS:
-                val = val[0]
-            size = struct.calcsize(fmt)
+            s = _int_struct(typ, cnt)
+            if lazy and cnt > LAZY_MIN_COUNT:
+                val = LazyVal(s.unpack_from, store, off)
+            else:
+                val = s.unpack_from(store, off)
+                if cnt == 1 and tag in _SCALAR_TAGS:
+                    val = val[0]
+            size = s.size
         # string
         elif typ == 6:
-            val = next(iter_unpack_c_string(store, off))
-            size = len(val)+1
+            end = store.find(b'\0', off)
+            if end < 0:
+                raise HeaderError(f"unterminated string for tag {tag}")
+            val = store[off:end]
+            size = end+1-off
         # binary blob
         elif typ == 7:
             val = store[off:off+cnt]
             size = cnt
         # string array
         elif typ == 8:
-            val = tuple(iter_unpack_c_string(store, off, cnt))
-            size = sum(len(v)+1 for v in val)
+            val, size = unpack_c_strings(store, off, cnt)
         # i18n string array
         elif typ == 9:
-            val = tuple(iter_unpack_c_string(store, off, i18ncnt))
-            size = sum(len(v)+1 for v in val)
+            val, size = unpack_c_strings(store, off, i18ncnt)
         else:
             val = None
             size = 0
 
         # count only bytes that haven't been already counted
-        realsize = sum(1 for i in range(off, off+size) if i not in used)
-        # update which bytes we've counted
-        used.update(range(off, off+size))
+        if track_realsize:
+            realsize = _claim_range(used_starts, used_ends, off, off+size)
+        else:
+            realsize = size
 
         yield (tag, typ, off, cnt, size, realsize, val)
 
+class TagValues(dict):
+    '''
+    A dict of {tag:value} that unpacks any LazyVal values the first time
+    they're accessed. Most users of a header only look at a handful of tags,
+    so this saves unpacking the big per-file arrays if nobody wants them.
+    '''
+    def __getitem__(self, tag):
+        val = dict.__getitem__(self, tag)
+        if type(val) is LazyVal:
+            val = val()
+            dict.__setitem__(self, tag, val)
+        return val
+
+    def get(self, tag, default=None):
+        return self[tag] if tag in self else default
+
+    def values(self):
+        return [self[tag] for tag in self]
+
+    def items(self):
+        return [(tag, self[tag]) for tag in self]
+
 class TagEntry(namedtuple("TagEntry", "tag type offset count size realsize")):
+    __slots__ = ()
     _struct = struct.Struct("! 4L")
     def _pack(self):
         return self._struct.pack(self.tag, self.type, self.offset, self.count)
@@ -168,22 +283,31 @@ def archnum(arch):
 class HeaderError(ValueError):
     pass
 
+_MISSING = object()
+
 class rpmsection(object):
     '''
     Hold RPM Signature/Header Section data (rpmhdr.hdr, rpmhdr.sig)
     This object is mostly good for raw access to the contained data.
     '''
-    def __init__(self, fobj, pad=False):
+    # There are two of these for every RPM we look at, so skip the __dict__
+    __slots__ = ('is_sig', '_bin_tags', 'size', 'padsize', 'store', 'tagent',
+                 'tagval', '_valcache', 'encoding', 'regiontag')
+
+    def __init__(self, fobj, pad=False, track_realsize=False):
         tagents, store = read_section_header(fobj, pad)
         self.is_sig = bool(pad)
-        self._bin_tags = (SIG_BIN_TAGS if self.is_sig else BIN_TAGS)
+        self._bin_tags = (_SIG_BIN_TAGS if self.is_sig else _BIN_TAGS)
         self.size = 16 + 16*len(tagents) + len(store)
-        self.padsize = (8-len(store)%8) if pad else 0
+        self.padsize = (-len(store) & 7) if pad else 0
         self.store = store
-        self.tagent = OrderedDict()
-        self.tagval = OrderedDict()
+        self.tagent = dict()
+        self.tagval = TagValues()
+        self._valcache = dict()
         self.encoding = 'utf-8'
-        for tag, typ, off, cnt, size, rsize, val in iter_parse_tags(tagents, store):
+        for tag, typ, off, cnt, size, rsize, val in iter_parse_tags(tagents, store,
+                                                                    track_realsize,
+                                                                    lazy=True):
             self.tagent[tag] = TagEntry(tag, typ, off, cnt, size, rsize)
             self.tagval[tag] = val
             if tag == 5062:  # ENCODING
@@ -191,17 +315,21 @@ class rpmsection(object):
         self.regiontag = self.verify_region()
 
     @classmethod
-    def from_bytes(cls, data, pad=False):
+    def from_bytes(cls, data, pad=False, track_realsize=False):
         from io import BytesIO
-        return cls(BytesIO(data), pad=pad)
+        return cls(BytesIO(data), pad=pad, track_realsize=track_realsize)
 
 
     def pack(self):
         '''Pack this section into a bytes object'''
-        idx = TagEntry._struct.pack(HDRMAGIC, 0, len(self.tagent), len(self.store))
-        tagents = b''.join(te._pack() for te in self.tagent.values())
-        padding = b'\0' * self.padsize
-        return idx + tagents + self.store + padding
+        # Gather all the pieces and join them once; concatenating them one
+        # at a time copies the (possibly large) store more than once.
+        pack = idx_s.pack
+        parts = [hdr_s.pack(HDRMAGIC, 0, len(self.tagent), len(self.store))]
+        parts += [pack(tag, typ, off, cnt)
+                  for tag, typ, off, cnt, _, _ in self.tagent.values()]
+        parts += (self.store, b'\0' * self.padsize)
+        return b''.join(parts)
 
     def verify_region(self, regiontag=None):
         te = None
@@ -225,8 +353,7 @@ class rpmsection(object):
             raise HeaderError("region offset bad")
 
         # Okay cool, decode the trailer.
-        (tag, typ, off, cnt) = struct.unpack("!LLlL",
-                                             self.store[te.offset:te.offset+te.count])
+        (tag, typ, off, cnt) = trailer_s.unpack_from(self.store, te.offset)
         # NOTE: the trailer's offset field is negative, so.. negate it
         trailer = TagEntry(tag, typ, -off, cnt, None, None)
 
@@ -256,6 +383,22 @@ class rpmsection(object):
         te = self.tagent[tag]
         return self.store[te.offset:te.offset+te.size]
 
+    def intarray(self, tag):
+        '''
+        Return the values of an integer-typed tag as an array.array, decoded
+        straight from the store. Unlike getval(), this doesn't create an int
+        object for every item, which is a lot cheaper for big per-file arrays
+        if you're just going to sum() them or whatever.
+        '''
+        te = self.tagent[tag]
+        if not 0 < te.type <= 5:
+            raise ValueError(f"tag {tag} is not an integer type")
+        a = array(array_type_char[te.type])
+        a.frombytes(self.store[te.offset:te.offset+te.size])
+        if sys.byteorder == 'little':
+            a.byteswap()
+        return a
+
     def getval(self, tag, default=None):
         '''
         Return the value for the given tag, decoded to its expected type:
@@ -268,23 +411,32 @@ class rpmsection(object):
 
         returns default if tag is not found in this section.
         '''
-        if tag not in self.tagval:
+        # The section doesn't change after it's parsed, and all the decoded
+        # values are immutable, so we only need to decode each one once.
+        val = self._valcache.get(tag, _MISSING)
+        if val is not _MISSING:
+            return val
+        te = self.tagent.get(tag)
+        if te is None:
             return default
-        val = self.tagval[tag]
-        typ = self.tagent[tag].type
-        enc = self.encoding
+        val, typ = self.tagval[tag], te.type
         if typ < 6:  # int arrays
-            return val
+            pass
         elif tag in self._bin_tags:  # binary blobs
-            return bytes(val)
-        elif type(val) == bytes:  # plain string
-            return val.decode(enc, errors='backslashreplace')
-        elif type(val) == tuple and type(val[0]) == bytes:  # string array
-            return tuple(v.decode(enc, errors='backslashreplace') for v in val)
-            return val[0] if tag in SCALAR_TAGS else val
+            val = bytes(val)
+        elif typ <= 7:  # plain string (or a non-binary BIN value)
+            val = val.decode(self.encoding, errors='backslashreplace')
+        elif typ <= 9 and len(val) == 1 and tag in _SCALAR_TAGS:
+            # e.g. SUMMARY: an i18n string array, but it's a single string
+            val = val[0].decode(self.encoding, errors='backslashreplace')
+        elif typ <= 9:  # string array
+            enc = self.encoding
+            val = tuple(v.decode(enc, errors='backslashreplace') for v in val)
         else:
             msg = "unhandled value (typ:{} tag:{}): {}".format(typ, tag, val)
             raise ValueError(msg)
+        self._valcache[tag] = val
+        return val
 
     def jsonval(self, tag, default=None):
         '''
@@ -292,12 +444,13 @@ class rpmsection(object):
         (Same as getval(), but binary blobs are b64encoded into ascii strings.)
         '''
         from base64 import b64encode
-        val = self.getval(tag)
+        val = self.getval(tag, default)
         if type(val) == bytes:
             val = b64encode(val).decode('ascii', errors='ignore')
         return val
 
 class pkgtup(namedtuple('pkgtup', 'name arch epoch ver rel')):
+    __slots__ = ()
     def envra(self):
         # EPOCH is an int, but it's also optional (and 0 != None)
         if self.epoch is None:
@@ -316,10 +469,18 @@ class pkgtup(namedtuple('pkgtup', 'name arch epoch ver rel')):
     def match(self, other):
         return all((not s or s == o) for s,o in zip(self, other))
 
+    # Lots of packages share the same SOURCERPM, so cache the parsed result.
+    # (It's a tuple, so it's safe to hand the same one out repeatedly.)
     @classmethod
+    @lru_cache(maxsize=16384)
     def fromenvra(cls, envra):
         epoch, c, nvra = envra.partition(':')
-        if not c:
+        if c:
+            # int, same as rpmhdr.pkgtup, so match() works. Anything that
+            # isn't a number gets left alone, like it always was.
+            if epoch.isdigit():
+                epoch = int(epoch)
+        else:
             nvra = epoch
             epoch = None
         nvr, _, arch = nvra.rpartition('.')
@@ -345,11 +506,22 @@ class pkgtup(namedtuple('pkgtup', 'name arch epoch ver rel')):
         else:
             return cls.fromenvra(pkgstr)
 
+# Share a single rpm.ts between all rpmhdr instances. cache makes this a
+# lazily-created singleton (and keeps us from importing rpm unless needed).
+@cache
+def _rpm_ts():
+    import rpm
+    flags = (rpm.RPMVSF_NOHDRCHK |
+             rpm._RPMVSF_NODIGESTS |
+             rpm._RPMVSF_NOSIGNATURES)
+    return rpm.ts("/", flags)
+
 # Our equivalent to rpm.hdr - hold all the RPM's header data.
 class rpmhdr(object):
     # TODO/FIXME: we should be able to accept bytes or a fobj..
-    def __init__(self, filename=None, hdrbytes=None):
+    def __init__(self, filename=None, hdrbytes=None, track_realsize=False):
         self.name = filename
+        self.track_realsize = track_realsize
         self.lead = None
         self.sig = None
         self.hdr = None
@@ -362,8 +534,12 @@ class rpmhdr(object):
         else:
             raise ValueError("need filename or hdrbytes")
 
-        # Grab the pkgtup values
-        e,n,v,r,a = [self.hdr.getval(t) for t in (1003,1000,1001,1002,1022)]
+        # Grab the pkgtup values. These are always plain strings (and an int
+        # for EPOCH), so skip getval() and decode them directly.
+        tv, enc = self.hdr.tagval, self.hdr.encoding
+        n,v,r,a = [tv[t].decode(enc, errors='backslashreplace') if t in tv
+                   else None for t in (1000,1001,1002,1022)]
+        e = tv.get(1003)
         self.pkgtup = pkgtup(n, a, e, v, r)
         # For convenience's sake, save the package's ENVRA as a str
         self.envra = self.pkgtup.envra()
@@ -372,19 +548,27 @@ class rpmhdr(object):
         fobj = BytesIO(hdr)
         if hdr.startswith(RPMMAGIC_BYTES):
             self.lead = rpmlead_read(fobj)
-        self.sig = rpmsection(fobj, pad=True)
-        self.hdr = rpmsection(fobj, pad=False)
+        self.sig = rpmsection(fobj, pad=True,
+                              track_realsize=self.track_realsize)
+        self.hdr = rpmsection(fobj, pad=False,
+                              track_realsize=self.track_realsize)
         self.headersize = fobj.tell()
         self.payloadsize = None
 
     def read_file(self, filename):
-        with open(filename, 'rb') as fobj:
+        # mmap objects have read()/tell() like a file, but read() copies
+        # straight out of the page cache instead of going through a
+        # BufferedReader's buffer first.
+        with open(filename, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as fobj:
             self.lead = rpmlead._read(fobj)
-            self.sig = rpmsection(fobj, pad=True)
-            self.hdr = rpmsection(fobj, pad=False)
+            self.sig = rpmsection(fobj, pad=True,
+                                  track_realsize=self.track_realsize)
+            self.hdr = rpmsection(fobj, pad=False,
+                                  track_realsize=self.track_realsize)
             self.headersize = fobj.tell()
+            size = fobj.size()
 
-        size = os.stat(filename).st_size
         hsize = 0x60+self.sig.size+self.sig.padsize+self.hdr.size
         if self.headersize != hsize:
             raise HeaderError(f"headersize {self.headersize} != {hsize}")
@@ -407,16 +591,30 @@ class rpmhdr(object):
             res=b'\0'*16,
         )
 
+    @cached_property
+    def _files(self):
+        # NOTE: we don't use "getval" here because filenames are _always_
+        # encoded in UTF-8, regardless of the package encoding. In theory.
+        # String arrays are stored as a run of NUL-terminated strings, so we
+        # can decode all the dirnames (or basenames) straight out of the store
+        # in one go, which is a lot faster than decoding each one separately.
+        hdr = self.hdr
+        def strarray(tag):
+            if tag not in hdr.tagent:
+                return []
+            return hdr.rawval(tag)[:-1].decode('utf-8').split('\0')
+        dirnames = strarray(1118)
+        dirindexes = hdr.tagval.get(1116, [])
+        return tuple(dirnames[diridx]+basename for diridx, basename in
+                     zip(dirindexes, strarray(1117)))
+
     def iterfiles(self):
         '''Yield each of the (complete) filenames in this RPM.'''
-        dirindexes = self.hdr.tagval.get(1116, [])
-        basenames = self.hdr.tagval.get(1117, [])
-        dirnames = self.hdr.tagval.get(1118, [])
-        for diridx, basename in zip(dirindexes, basenames):
-            yield (dirnames[diridx]+basename).decode('utf-8')
+        return iter(self._files)
 
     def files(self):
-        return list(self.iterfiles())
+        '''Return a list of the (complete) filenames in this RPM.'''
+        return list(self._files)
 
     def nfiles(self):
         return len(self.hdr.tagval.get(1116, []))
@@ -440,21 +638,9 @@ class rpmhdr(object):
     # for convenience and _selftest(), get rpm-python's `hdr` for this RPM
     def _get_rpm_hdr(self):
         with open(self.name, 'rb') as fobj:
-            hdr = self._ts.hdrFromFdno(fobj.fileno())
+            hdr = _rpm_ts().hdrFromFdno(fobj.fileno())
         return hdr
 
-    # Share a single rpm.ts between all instances of this class
-    @property
-    def _ts(self):
-        if self.__class__.__ts is None:
-            import rpm
-            flags = (rpm.RPMVSF_NOHDRCHK |
-                     rpm._RPMVSF_NODIGESTS |
-                     rpm._RPMVSF_NOSIGNATURES)
-            self.__class__.__ts = rpm.ts("/", flags)
-        return self.__class__.__ts
-    __ts = None
-
     # Get the value of a given tag and munge it up to look like RPM's version.
     # Mostly useful for _selftest().
     def _get_rpm_val(self, tag):
@@ -465,7 +651,7 @@ class rpmhdr(object):
             val = list(val)
 
         # rpm enforces SCALAR_TAGS, even for things with type == 6
-        if tag not in SCALAR_TAGS and type(val) != list:
+        if tag not in _SCALAR_TAGS and type(val) != list:
             val = [val]
 
         # ..except for ENCODING. bluhhh RPM why are you like this.
@@ -474,15 +660,19 @@ class rpmhdr(object):
 
         # oh also this, which the rpm module rejiggers internally
         if tag == 1141:  # FILECLASS: val is a list of indexes into CLASSDICT
-            cd = self.hdr.tagval[1142]  # CLASSDICT: file(1) output, or ''
-            lt = self.hdr.tagval[1036]  # FILELINKTOS: link targets, or ''
-            # returned value is the CLASSDICT value (if non-empty);
-            # else 'symbolic link to `%s'" if it's a symlink, otherwise ''
-            val = [cd[i] or (lt[n] and b"symbolic link to `"+lt[n]+b"'")
-                   for n, i in enumerate(val)]
+            val = list(self._rpm_fileclass)
 
         return val
 
+    @cached_property
+    def _rpm_fileclass(self):
+        cd = self.hdr.tagval[1142]  # CLASSDICT: file(1) output, or ''
+        lt = self.hdr.tagval[1036]  # FILELINKTOS: link targets, or ''
+        # returned value is the CLASSDICT value (if non-empty);
+        # else 'symbolic link to `%s'" if it's a symlink, otherwise ''
+        return tuple(cd[i] or (lt[n] and b"symbolic link to `"+lt[n]+b"'")
+                     for n, i in enumerate(self.hdr.tagval[1141]))
+
     # Return the expected in-header size of this value, given its RPM vtype
     @staticmethod
     def _expsize(val, typ):
@@ -491,7 +681,7 @@ class rpmhdr(object):
         if typ == 0:
             return 0
         elif typ <= 5:
-            return struct.calcsize(fmt_type_char[typ]) * cnt
+            return _int_struct(typ, 1).size * cnt
         elif typ == 6 or typ == 8 or typ == 9:
             return sum(len(s)+1 for s in val) if isarray else len(val)+1
         elif typ == 7:
@@ -516,12 +706,9 @@ class rpmhdr(object):
             errmsg = msg.format(*args)
             return "{} ({}): {}".format(t, rpm.tagnames.get(t), errmsg)
 
-        # check each tag/val in the RPM header against our values
-        for t in hdr.keys():
-            # skip private tags (1046=RPMVERSION)
-            if t < 1000 or t == 1046:
-                continue
-
+        # check each tag/val in the RPM header against our values,
+        # skipping private tags (1046=RPMVERSION)
+        for t in [t for t in hdr.keys() if t >= 1000 and t != 1046]:
             # Do we also have this tag?
             assert t in self.hdr.tagent, terr(t, "not in hdr")
             te = self.hdr.tagent[t]
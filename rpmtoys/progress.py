@@ -1,6 +1,7 @@
 # progress.py - dumb simple progress meter wrapper
 
 import sys
+from operator import length_hint
 from time import monotonic
 from shutil import get_terminal_size
 
@@ -12,10 +13,16 @@ def progress(iterable,
              out=sys.stdout,
              flush=True):
     prog = Progress(prefix=prefix, interval=interval, out=out, flush=flush)
-    items = prog.count_then_start(iterable, countmsg=countmsg)
-    for i in items:
+    # Don't gather everything into a list just to count it; use the length
+    # if the iterable knows it, otherwise just show the count as we go.
+    # (countmsg is only kept for compatibility - there's no counting phase.)
+    total = length_hint(iterable, -1)
+    prog.start(total if total >= 0 else None)
+    for i in iterable:
         prog.item(itemfmt(i))
         yield i
+    if prog.total is None:
+        prog.total = prog.count
     prog.end()
 
 class Progress(object):
@@ -68,7 +75,7 @@ class Progress(object):
 
     @property
     def _tlen(self):
-        return len(str(self.total))
+        return len(str(self.total)) if self.total is not None else 1
 
     def start(self, total):
         self.total = total
@@ -82,7 +89,7 @@ class Progress(object):
 
     def __str__(self):
         return self._fmt.format(count=self.count,
-                                total=self.total or 0,
+                                total=self.total if self.total is not None else '?',
                                 prefix=self.prefix,
                                 item=self._item or "---",
                                 tlen=self._tlen,
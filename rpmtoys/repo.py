@@ -24,8 +24,35 @@ import os
 def iter_repo_rpms(paths):
     if type(paths) == str:
         paths = [paths]
-    for path in paths:
-        for top, dirs, files in os.walk(path):
-            for f in files:
-                if f.endswith(".rpm"):
-                    yield os.path.join(top, f)
+    # This is os.walk() without building the lists of dirs/files for each
+    # directory - we just check each DirEntry as scandir() hands it to us.
+    # Same order as os.walk() (top-down), and likewise doesn't follow
+    # symlinks to directories or complain about unreadable ones.
+    stack = list(reversed(paths))
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        subdirs = []
+        with it:
+            for ent in it:
+                if ent.is_dir():
+                    if not ent.is_symlink():
+                        subdirs.append(ent.path)
+                elif ent.name.endswith(".rpm"):
+                    yield ent.path
+        stack.extend(reversed(subdirs))
+
+
+def iter_repo_hdrs(paths, workers=None, chunksize=64):
+    '''
+    Like iter_repo_rpms, but yield a parsed rpmhdr for each RPM instead.
+    Parsing happens in a pool of `workers` processes (default: one per CPU),
+    so this scales with the number of cores; `chunksize` filenames get sent
+    to a worker at a time to keep the IPC overhead down.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    from .hdr import rpmhdr
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        yield from ex.map(rpmhdr, iter_repo_rpms(paths), chunksize=chunksize)
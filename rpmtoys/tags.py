@@ -17,6 +17,7 @@
 # Author: Will Woods <wwoods@redhat.com>
 
 from enum import IntEnum
+from functools import lru_cache
 from .tagtbl import tagtbl
 from .sigtagtbl import sigtagtbl
 
@@ -43,6 +44,14 @@ class RType(IntEnum):
     MAPPING = 0x00040000
     MASK = 0xffff0000
 
+# {initial: [names...]} for the members of the given TagEnum
+@lru_cache(maxsize=None)
+def _names_by_initial(enumcls):
+    byinitial = dict()
+    for name in enumcls._member_names_:
+        byinitial.setdefault(name[0], []).append(name)
+    return byinitial
+
 class TagEnum(IntEnum):
     '''
     RPM tag info - see rpm/lib/tagname.c:headerTagTableEntry_s
@@ -66,15 +75,23 @@ class TagEnum(IntEnum):
 
     @classmethod
     def getname(self, num):
-        try:
-            return self(num).name
-        except ValueError:
-            return str(num)
+        # Look it up directly rather than catching the ValueError from
+        # self(num) - unknown tags aren't unusual, and exceptions are slow.
+        tag = self._value2member_map_.get(num)
+        return tag.name if tag is not None else str(num)
 
     @classmethod
     def byprefix(self, pfx):
+        # Going through the member names directly is a lot quicker than
+        # iterating the enum and fetching each member's .name, and we only
+        # need to check the names that start with the right letter. This
+        # adds up when we build the dependency/scriptlet groupings at import.
         if type(pfx) == str:
-            return {t for t in Tag if t.name.startswith(pfx.upper())}
+            pfx = pfx.upper()
+            members = self._member_map_
+            names = (_names_by_initial(self).get(pfx[0], ()) if pfx
+                     else self._member_names_)
+            return {members[n] for n in names if n.startswith(pfx)}
         else:
             return {t for p in pfx for t in self.byprefix(p)}
 
@@ -93,14 +110,15 @@ SigTag = TagEnum('SigTag', ((t[0].upper(), t) for t in
 
 # --- Below here we have a bunch of tag metadata (meta-metadata?)
 
+# NOTE: these are all frozensets, since they're constant lookup tables.
 # Tags that have binary values
-BIN_TAGS = {t for t in Tag if t.vtype == VType.BIN}
-SIG_BIN_TAGS = {t for t in SigTag if t.vtype == VType.BIN}
+BIN_TAGS = frozenset(t for t in Tag if t.vtype == VType.BIN)
+SIG_BIN_TAGS = frozenset(t for t in SigTag if t.vtype == VType.BIN)
 # Tags that have non-array values
-SCALAR_TAGS = {t for t in Tag if t.rtype == RType.SCALAR}
-SIG_SCALAR_TAGS = {t for t in SigTag if t.rtype == RType.SCALAR}
+SCALAR_TAGS = frozenset(t for t in Tag if t.rtype == RType.SCALAR)
+SIG_SCALAR_TAGS = frozenset(t for t in SigTag if t.rtype == RType.SCALAR)
 # Tags that have array values with one item per file
-PER_FILE_TAGS = {
+PER_FILE_TAGS = frozenset({
     Tag.FILESIZES,
     Tag.FILEMODES,
     Tag.FILERDEVS,
@@ -123,7 +141,7 @@ PER_FILE_TAGS = {
     Tag.FILECAPS,
     Tag.FILESIGNATURES, # XXX unverified
     # Tag.PREFIXES?
-}
+})
 
 # Group dependencies by type. Note that the names are a _prefix_ for a bunch of
 # tags that get zipped together inside RPM to create each dependency "item".
@@ -142,18 +160,18 @@ SCRIPTLET_GROUPS = {
 }
 
 # map each name "stem" to corresponding set of tag numbers
-DEPENDENCY_NAMES = {n:Tag.byprefix(n)
+DEPENDENCY_NAMES = {n:frozenset(Tag.byprefix(n))
                     for gn in DEPENDENCY_GROUPS.values() for n in gn}
-SCRIPTLET_NAMES = {n:Tag.byprefix(n)
+SCRIPTLET_NAMES = {n:frozenset(Tag.byprefix(n))
                    for sn in SCRIPTLET_GROUPS.values() for n in sn}
 
 # Here's a couple of groupings for SigTags.
-SIGNATURE_SIGTAGS = {SigTag.PGP, SigTag.GPG, SigTag.DSA, SigTag.RSA}
-DIGEST_SIGTAGS = {SigTag.MD5, SigTag.SHA1, SigTag.SHA256}
+SIGNATURE_SIGTAGS = frozenset({SigTag.PGP, SigTag.GPG, SigTag.DSA, SigTag.RSA})
+DIGEST_SIGTAGS = frozenset({SigTag.MD5, SigTag.SHA1, SigTag.SHA256})
 
 # Lovingly handcrafted tag groupings.
 # This covers every tag known to rpm-4.16.0. Whee!
-tag_group = {name:{Tag(t) for t in grp} for (name, grp) in {
+tag_group = {name:frozenset(Tag(t) for t in grp) for (name, grp) in {
     "FILEDIGESTS": {1035, 5011},
     "FILENAMES":   {1116, 1117, 1118, 5000},
     "FILESTAT":    {1028, 1029, 1030, 1033, 1034, 1036, 1039, 1040,
@@ -178,16 +196,16 @@ tag_group = {name:{Tag(t) for t in grp} for (name, grp) in {
     "SIGNATURES":  {62, 257, 259, 261, 262, 266, 267, 268, 269, 270, 271, 273,
                     5090, 5091},
     "CHANGELOG":   Tag.byprefix("Changelog"),
-    "DEPENDENCY":  Tag.byprefix(DEPENDENCY_NAMES),
-    "SCRIPTLET":   Tag.byprefix(SCRIPTLET_NAMES),
+    "DEPENDENCY":  set().union(*DEPENDENCY_NAMES.values()),
+    "SCRIPTLET":   set().union(*SCRIPTLET_NAMES.values()),
 }.items()}
 
 # And the catch-all for any Tag that's not already in another tag_group
-tag_group["UNGROUPED"] = set(Tag).difference(*tag_group.values())
+tag_group["UNGROUPED"] = frozenset(Tag).difference(*tag_group.values())
 
 # Map {int/Tag:groupname}
 groupname = {t:name for (name, grp) in tag_group.items() for t in grp}
 
-# Confirm that each tag only belongs to one group
-assert(len(set(i for s in tag_group.values() for i in s)) ==
-       len(list(i for s in tag_group.values() for i in s)))
+# Confirm that each tag only belongs to one group. (groupname has one entry
+# per tag, so if any tag was in two groups it'll be short.)
+assert(len(groupname) == sum(len(grp) for grp in tag_group.values()))
@@ -6,24 +6,26 @@
 # For details, see:
 # https://github.com/rpm-software-management/rpm/blob/master/lib/rpmvercmp.c
 
-from ctypes import c_uint32
+import re
 from string import ascii_letters, digits
-from functools import cmp_to_key
 
+# Epochs are uint32 in RPM; anything that isn't an int (e.g. None) counts as 0.
+# (Same result as c_uint32(v).value, without making a ctypes object - or
+# raising and catching an exception for every missing epoch.)
 def _get_epoch(v):
-    try:
-        return c_uint32(v).value
-    except TypeError:
-        return 0
+    return v & 0xffffffff if isinstance(v, int) else 0
 
-_alnum = ascii_letters + digits
-_verch = _alnum + '~' + '^'
+# Sets rather than strings, so `ch in ...` is a hash lookup, not a scan
+_digits = frozenset(digits)
+_letters = frozenset(ascii_letters)
+_alnum = _letters | _digits
+_verch = _alnum | {'~', '^'}
 
 def risdigit(ch):
-    return ch in digits
+    return ch in _digits
 
 def risalpha(ch):
-    return ch in ascii_letters
+    return ch in _letters
 
 def risalnum(ch):
     return ch in _alnum
@@ -41,6 +43,23 @@ def take_while(s, match):
 def take_until(s, match):
     return take_while(s, lambda ch: not match(ch))
 
+# rpmvercmp() uses these instead of take_while/take_until: the regex engine
+# scans the run of matching characters in C, rather than us calling a
+# Python function for every character. Call them as run(s, pos).end() to
+# find where a run starting at `pos` ends.
+_nonverch_run = re.compile('[^A-Za-z0-9~^]*').match
+_digit_run = re.compile('[0-9]*').match
+_alpha_run = re.compile('[A-Za-z]*').match
+
+# How the next "thing" in a version string sorts, compared to the next thing in
+# the other string: tilde sorts lower than anything else (even the end of the
+# string), caret sorts lower than anything except the end of the string, and
+# numeric segments sort higher than alpha segments. rpmver_key() uses the
+# same ranks.
+_rank = {'~': 0, '': 1, '^': 2}
+_rank.update(dict.fromkeys(ascii_letters, 3))
+_rank.update(dict.fromkeys(digits, 4))
+
 def rpmvercmp(a, b):
     '''
     Compare two version strings, returning (-1, 0, 1) for (a<b, a==b, a>b),
@@ -50,86 +69,65 @@ def rpmvercmp(a, b):
     if a == b:
         return 0
 
-    # This is kinda dumb but I'm trying to make it obvious that this is a
-    # direct translation of RPM's algorithm..
-    one = a
-    two = b
-
-    while one or two:
-        # pop characters off 'til we hit a valid version character
-        _, one = take_until(one, risverch)
-        _, two = take_until(two, risverch)
-
-        ch1 = one[0:1]
-        ch2 = two[0:1]
-
-        # tilde sorts lower than anything else
-        if ch1 == '~' or ch2 == '~':
-            if ch1 != '~': return 1
-            if ch2 != '~': return -1
-            one = one[1:]
-            two = two[1:]
-            continue
-
-        # caret works like tilde, except that if one of the strings ends
-        # the other is considered "higher"
-        if ch1 == '^' or ch2 == '^':
-            if one == '': return -1
-            if two == '': return 1
-            if ch1 != '^': return 1
-            if ch2 != '^': return -1
-            one = one[1:]
-            two = two[1:]
+    # Like the C version, we walk a cursor along each string (i for a, j for
+    # b) rather than chopping bits off the front of them, so we only copy
+    # the segments that we actually compare.
+    # RPM's tilde/caret/end-of-string/segment-type checks all boil down to
+    # comparing the _rank of the next character in each string, so that's
+    # what we do here.
+    i = j = 0
+    while True:
+        # skip ahead 'til we hit a valid version character (or the end)
+        i = _nonverch_run(a, i).end()
+        j = _nonverch_run(b, j).end()
+
+        r1 = _rank[a[i:i+1]]
+        r2 = _rank[b[j:j+1]]
+        if r1 != r2:
+            return -1 if r1 < r2 else 1
+
+        # Both are tilde, caret, or the end of the string
+        if r1 < 3:
+            # They both ended at the same time - they're equal!
+            if r1 == 1:
+                return 0
+            i += 1
+            j += 1
             continue
 
-        # If we hit the end of either string we're done.
-        if not (one and two):
-            break
-
-        # Break the first completely alpha or numeric segment off each string
-        if risdigit(one[0]):
-            isnum = True
-            s1, one = take_while(one, risdigit)
-            s2, two = take_while(two, risdigit)
-        else:
-            isnum = False
-            s1, one = take_while(one, risalpha)
-            s2, two = take_while(two, risalpha)
-
-        # If s2 is empty, then we had two segments of different types.
-        # In that case, the numeric side is considered higher/newer.
-        if not s2:
-            return 1 if isnum else -1
+        # Break off the next completely alpha or numeric segment
+        isnum = (r1 == 4)
+        run = _digit_run if isnum else _alpha_run
+        end1 = run(a, i).end()
+        end2 = run(b, j).end()
+        s1, i = a[i:end1], end1
+        s2, j = b[j:end2], end2
 
         # For numbers, we strip leading zeroes and then assume longer numbers
         # are bigger. If they're the same length, we'll use a simple strcmp.
         if isnum:
             s1 = s1.lstrip('0')
             s2 = s2.lstrip('0')
-            if len(s1) > len(s2):
-                return 1
-            if len(s1) < len(s2):
-                return -1
+            if len(s1) != len(s2):
+                return -1 if len(s1) < len(s2) else 1
 
         # Compare the segments as strings
-        if s1 < s2:
-            return -1
-        if s1 > s2:
-            return 1
+        if s1 != s2:
+            return -1 if s1 < s2 else 1
         # No difference found. Keep iterating through the strings.
 
-    # They both ended at the same time - they're equal!
-    if not (one or two):
-        return 0
-    # Otherwise, whichever has characters left over wins
-    return 1 if one else -1
-
 # This function signature is gross, but this is how RPM rolls..
 def rpm_evr_cmp(a, b):
     '''
     Compare two (e, v, r) tuples, returning (-1, 0, 1) for (a<b, a==b, a>b),
     as per rpm/lib/rpmvercmp.c:rpmVersionCompare()
     '''
+    # Identical EVRs are common (e.g. the same package in different repos),
+    # and one tuple compare is a lot cheaper than the full comparison.
+    # (rpmvercmp() also checks for identical strings first thing, so we
+    # don't need to do that for the versions/releases here.)
+    if a == b:
+        return 0
     # rpmVersionCompare says:
     # "Missing epoch becomes zero here, which is what we want"
     e1, v1, r1 = _get_epoch(a[0]), a[1], a[2]
@@ -146,9 +144,44 @@ def rpm_evr_cmp(a, b):
     # If versions match, compare releases
     return rpmvercmp(r1, r2)
 
-rpm_evr_key = cmp_to_key(rpm_evr_cmp)
+# For sorting, it's a lot faster to turn each version into a key once and let
+# sort() compare the keys than to call rpm_evr_cmp() O(n log n) times.
+# rpmvercmp() effectively compares the strings one segment at a time, and the
+# segments sort like so: '~' < (end of string) < '^' < alpha < numeric.
+# So we make each segment a tuple that starts with its _rank, followed by
+# whatever's needed to compare segments of the same kind, and put an
+# end-of-string marker on the end. Plain tuple comparison then gives the
+# same answers as rpmvercmp().
+_segments = re.compile('~|\\^|[0-9]+|[A-Za-z]+').findall
+_tilde_seg, _end_seg, _caret_seg = (0,), (1,), (2,)
+
+def rpmver_key(v):
+    '''
+    Return a key for version string `v` that sorts the same as rpmvercmp(),
+    i.e. rpmver_key(a) < rpmver_key(b) iff rpmvercmp(a, b) == -1.
+    '''
+    key = []
+    for seg in _segments(v):
+        if seg == '~':
+            key.append(_tilde_seg)
+        elif seg == '^':
+            key.append(_caret_seg)
+        elif seg[0] in _digits:
+            # numbers: longer (ignoring leading zeroes) is bigger
+            seg = seg.lstrip('0')
+            key.append((4, len(seg), seg))
+        else:
+            key.append((3, seg))
+    key.append(_end_seg)
+    return tuple(key)
+
+def rpm_evr_key(evr):
+    '''Sort key for (e, v, r) tuples; sorts the same as rpm_evr_cmp()'''
+    return (_get_epoch(evr[0]), rpmver_key(evr[1]), rpmver_key(evr[2]))
 
 def pkgtup_cmp(a, b):
     return rpm_evr_cmp((a.epoch, a.ver, a.rel), (b.epoch, b.ver, b.rel))
 
-pkgtup_key = cmp_to_key(pkgtup_cmp)
+def pkgtup_key(p):
+    '''Sort key for pkgtups (by EVR); sorts the same as pkgtup_cmp()'''
+    return (_get_epoch(p.epoch), rpmver_key(p.ver), rpmver_key(p.rel))
@@ -12,6 +12,7 @@
 # not have the latest librpm available.
 
 import re
+import sys
 import json
 import argparse
 from collections import namedtuple
@@ -41,10 +42,10 @@ RPMTYPECODE = {
 # * The 'extension' flag is present in librpm's headerTagTableEntry struct,
 #   and marks whether this is an "Extension or 'real' tag", according to rpm.
 # * The others are not used in the code; they're purely informational.
-FLAGWORDS = {
+FLAGWORDS = frozenset({
     'internal', 'unimplemented', 'extension',
     'unused', 'deprecated', 'obsolete', 'hidden',
-}
+})
 
 # Here we have single-letter codes for the flags.
 # "unused" and "unimplemented" are intentionally folded into each other,
@@ -67,6 +68,9 @@ CODE2FLAG = {
     'h': 'hidden',
 }
 
+# Each flagword, mapped to its normalized name (e.g. 'obsolete'->'deprecated')
+NORMALIZE = {f: CODE2FLAG[FLAGCODES[f]] for f in FLAGWORDS}
+
 # Known tag/define prefixes, with short abbreviations
 GRP_NAME = {
     'HEADER':    'HDR',
@@ -94,6 +98,9 @@ RPMTAG_RE = re.compile(TAGPAT+COMMENT, re.MULTILINE|re.VERBOSE)
 ENUM_RE = re.compile(ENUMPAT+COMMENT, re.VERBOSE)
 DEF_RE = re.compile(DEFPAT+COMMENT, re.VERBOSE)
 
+# Used to split comments into words, ignoring punctuation etc.
+split_nonword = re.compile(r'\W+').split
+
 class TagLineMatch(namedtuple("TagLineMatch", "isdef name expr comment")):
     @property
     def sym(self):
@@ -104,6 +111,16 @@ class TagTableItem(namedtuple("TagTableItem", "prefix shortname id typecode flag
     def grp(self):
         return GRP_NAME.get(self.prefix)
 
+# Simple expression parser - just enough to get the job done.
+# The only operator rpmtag.h uses is '+', and each term is either a
+# previously-defined symbol (in syms) or an integer literal (e.g. 1000, 0x10).
+def evalexpr(expr, syms):
+    val = 0
+    for term in expr.split('+'):
+        term = term.strip()
+        val += syms[term] if term in syms else int(term, 0)
+    return val
+
 # The actual parsing function.
 def iterparse_rpmtag_h(rpmtag_h):
     '''
@@ -123,59 +140,67 @@ def iterparse_rpmtag_h(rpmtag_h):
     isdef is a bool.
     id is an int.
     typecode is one of the keys in RPMTYPECODE (and may be None).
-    flags is a set, and a subset of FLAGWORDS (and may be empty).
+    flags is a frozenset, and a subset of FLAGWORDS (and may be empty).
     '''
     # dict to hold symbols we've encountered while parsing
     syms = dict()
 
-    # simple expression parser - just enough to get the job done
-    def evalexpr(expr):
-        if '+' in expr:
-            l,r = expr.split('+',1)
-            return evalexpr(l.strip()) + evalexpr(r.strip())
-        elif expr in syms:
-            return syms[expr]
-        elif expr.startswith('0x'):
-            return int(expr, 16)
-        else:
-            return int(expr)
-
     # Matches are ('#define|', name, expr, comment) tuples.
     for isdef, name, expr, comment in RPMTAG_RE.findall(rpmtag_h):
         # Evaluate expr to val, and save it to syms[name] for later lookup
-        syms[name] = val = evalexpr(expr)
+        syms[name] = val = evalexpr(expr, syms)
         # Split name into prefix and shortname
-        prefix, shortname = name.split('_', 1)
+        prefix, _, shortname = name.partition('_')
         # If there's a typecode, it'll be the first word of the comment.
         # Split comment (which may be None) on whitespace and check it.
         words = [] if not comment else comment.strip().split()
         typecode = words[0] if words and words[0] in RPMTYPECODE else None
         # Re-split comment, stripping all non-word chars, to find flagwords.
-        flags = FLAGWORDS.intersection(re.split(r'\W+', comment))
+        # (Not str.split(), since flags can look like "@deprecated" or "internal.")
+        flags = FLAGWORDS.intersection(split_nonword(comment)) if comment else frozenset()
 
         match = TagLineMatch(bool(isdef), name, expr, comment)
         item = TagTableItem(prefix, shortname, val, typecode, flags)
 
         yield item, match
 
+def parse_rpmtag_h(rpmtag_h):
+    '''
+    Parse rpmtag.h all at once, returning a list of the (item, match) pairs
+    yielded by iterparse_rpmtag_h().
+
+    The dump_tagtbl_* functions accept this list in place of the text of
+    rpmtag.h, so you can generate several formats from one parse.
+    '''
+    return list(iterparse_rpmtag_h(rpmtag_h))
+
+def _iterparsed(rpmtag_h):
+    '''Iterate over (item, match) pairs from rpmtag.h text or parsed list'''
+    if isinstance(rpmtag_h, str):
+        return iterparse_rpmtag_h(rpmtag_h)
+    return iter(rpmtag_h)
+
 # Find & filter out aliases in the parsed output.
 def generate_tagtbl_items(rpmtag_h):
     '''
     Parse rpmtag.h, keeping tag alias names as separate items.
+    rpmtag_h can be the text of rpmtag.h or the output of parse_rpmtag_h().
     Yields pairs: (tag: TagTableItem, aliases: List[str])
     '''
-    buf, aliases = None, []
+    buf, bufkey, aliases = None, None, []
 
-    for item, _ in iterparse_rpmtag_h(rpmtag_h):
-        if not item.grp:
+    for item, _ in _iterparsed(rpmtag_h):
+        grp = item.grp
+        if not grp:
             continue
         # If we see the same group/val as before, it's an alias
-        if buf and (item.grp, item.id) == (buf.grp, buf.id):
+        key = (grp, item.id)
+        if key == bufkey:
             aliases.append(item.shortname)
             continue
         if buf:
             yield buf, aliases
-        buf, aliases = item, []
+        buf, bufkey, aliases = item, key, []
 
     if buf:
         yield buf, aliases
@@ -198,6 +223,9 @@ def dump_tagtbl_json(rpmtag_h, indent=2):
     }
 
     Note that `typecode` may be null.
+
+    If `indent` is None, the output is compact: one line, with no spaces
+    after separators.
     '''
     taginfo = {}
     for tag, aliases in generate_tagtbl_items(rpmtag_h):
@@ -206,7 +234,11 @@ def dump_tagtbl_json(rpmtag_h, indent=2):
         d["aliases"] = aliases
         d.pop("prefix")
         taginfo.setdefault(tag.grp, []).append(d)
-    print(json.dumps(taginfo, indent=indent))
+    if indent is None:
+        out = json.dumps(taginfo, separators=(',', ':'))
+    else:
+        out = json.dumps(taginfo, indent=indent)
+    sys.stdout.write(out + '\n')
 
 
 def dump_tagtbl_txt(rpmtag_h, normalize_flags=True):
@@ -226,14 +258,17 @@ def dump_tagtbl_txt(rpmtag_h, normalize_flags=True):
 
     '-' will be used as a placeholder when `typecode` or `flags` is empty.
     '''
+    lines = []
     for tag, aliases in generate_tagtbl_items(rpmtag_h):
-        flags = tag.flags
+        # copy, so adding aliases doesn't modify the parsed items
+        flags = set(tag.flags)
         if normalize_flags:
-            flags = set(CODE2FLAG[FLAGCODES[f]] for f in tag.flags)
+            flags = {NORMALIZE[f] for f in tag.flags}
         if aliases:
             flags.add(f'alias={",".join(aliases)}')
-        outstr = f'{tag.grp:3}  {tag.id:<7}  {tag.shortname:30}  {tag.typecode or "-":3}  {" ".join(sorted(flags)) or "-"}'
-        print(outstr)
+        lines.append(f'{tag.grp:3}  {tag.id:<7}  {tag.shortname:30}  {tag.typecode or "-":3}  {" ".join(sorted(flags)) or "-"}')
+    # One write for the whole table, rather than a print() per line
+    sys.stdout.write(''.join(l + '\n' for l in lines))
 
 
 def dump_tagtbl_C(rpmtag_h):
@@ -244,7 +279,7 @@ def dump_tagtbl_C(rpmtag_h):
         AWK=awk LC_ALL=C gentagtbl.sh rpmtag.h
     '''
     items = []
-    for item, match in iterparse_rpmtag_h(rpmtag_h):
+    for item, match in _iterparsed(rpmtag_h):
         # Only match names starting with RPMTAG_ and _no_ other underscores.
         if item.prefix != 'RPMTAG' or '_' in item.shortname:
             continue
@@ -256,11 +291,12 @@ def dump_tagtbl_C(rpmtag_h):
         ext = 1 if 'extension' in item.flags else 0
         items.append(f'    {{ "{match.name}", "{item.shortname.capitalize()}", {match.sym}, RPM_{tt}_TYPE, RPM_{ta}_RETURN_TYPE, {ext} }},')
 
-    print('static const struct headerTagTableEntry_s rpmTagTable[] = {')
-    for i in sorted(items):
-        print(i)
-    print('    { NULL, NULL, RPMTAG_NOT_FOUND, RPM_NULL_TYPE, 0 }')
-    print('};')
+    items.sort()
+    out = ['static const struct headerTagTableEntry_s rpmTagTable[] = {',
+           *items,
+           '    { NULL, NULL, RPMTAG_NOT_FOUND, RPM_NULL_TYPE, 0 }',
+           '};']
+    sys.stdout.write('\n'.join(out) + '\n')
 
 
 if __name__ == '__main__':
@@ -272,12 +308,14 @@ if __name__ == '__main__':
     p.add_argument("-o", "--output",
             choices=("C", "text", "json"), default="json",
             help="output format")
+    p.add_argument("--compact", action="store_true",
+            help="write compact (unindented) JSON")
     args = p.parse_args()
 
-    rpmtagdata = args.rpmtag_h.read()
+    rpmtagdata = parse_rpmtag_h(args.rpmtag_h.read())
 
     if args.output == "json":
-        dump_tagtbl_json(rpmtagdata)
+        dump_tagtbl_json(rpmtagdata, indent=None if args.compact else 2)
     elif args.output == "C":
         dump_tagtbl_C(rpmtagdata)
     elif args.output == "text":
@@ -1,8 +1,10 @@
+import struct
 import unittest
+from unittest import mock
 from .test_common import RPMFILE
 
 from rpmtoys import Tag
-from rpmtoys.hdr import rpmhdr, TagEntry
+from rpmtoys.hdr import rpmhdr, TagEntry, pkgtup
 
 # Yeah, I know these are more like functional tests than unit tests, but this
 # is a toy library and these get the job done.
@@ -26,6 +28,10 @@ class RPMhdr(unittest.TestCase):
         # Tag 1048 (REQUIREFLAGS) is the 30th tag in this RPM
         self.assertEqual(list(self.r.hdr.tagent).index(1048), 30)
 
+    def test_intarray(self):
+        self.assertEqual(tuple(self.r.hdr.intarray(1048)),
+                         self.r.hdr.getval(1048))
+
     def test_encoding_val(self):
         self.assertEqual(self.r.hdr.encoding,
                          self.r.hdr.tagval[Tag.ENCODING].decode('ascii'))
@@ -42,6 +48,18 @@ class TagEntryStruct(unittest.TestCase):
     def test_pack(self):
         self.assertEqual(self.te_item._pack(), self.te_bytes)
 
+    def test_struct(self):
+        # _pack/_unpack should share one precompiled Struct, not build one
+        # per call
+        self.assertIsInstance(TagEntry._struct, struct.Struct)
+        self.assertEqual(TagEntry._struct.size, len(self.te_bytes))
+        s = mock.Mock(wraps=TagEntry._struct)
+        with mock.patch.object(TagEntry, '_struct', s):
+            self.assertEqual(self.te_item._pack(), self.te_bytes)
+            TagEntry._unpack(self.te_bytes)
+        s.pack.assert_called_once_with(1048, 4, 444, 5)
+        s.unpack.assert_called_once_with(self.te_bytes)
+
     def test_fields(self):
         self.assertEqual(self.te_item.tag, 1048)
         self.assertEqual(self.te_item.type, 4)
@@ -50,3 +68,17 @@ class TagEntryStruct(unittest.TestCase):
         self.assertEqual(self.te_item.size, 20)
         self.assertEqual(self.te_item.realsize, 20)
 
+
+class PkgTup(unittest.TestCase):
+    def test_fromenvra(self):
+        self.assertEqual(pkgtup.fromenvra('fuse-common-3.5.0-1.fc30.x86_64'),
+                         ('fuse-common', 'x86_64', None, '3.5.0', '1.fc30'))
+        self.assertEqual(pkgtup.fromenvra('2:vim-minimal-8.1-1.fc30.x86_64'),
+                         ('vim-minimal', 'x86_64', 2, '8.1', '1.fc30'))
+
+    def test_fromenvra_matches_hdr(self):
+        # Neither test RPM has an epoch, so give the header side one to
+        # check that fromenvra's epoch has the same type as rpmhdr's.
+        r = rpmhdr(RPMFILE['fuse-common'])
+        self.assertTrue(r.pkgtup._replace(epoch=2).match(
+                        pkgtup.fromenvra('2:' + r.envra)))
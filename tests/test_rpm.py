@@ -34,3 +34,18 @@ class FileInfo(unittest.TestCase):
 
     def test_nfiles_1(self):
         self.assertEqual(self._rpm.nfiles(), 1)
+
+    def test_files_1(self):
+        self.assertEqual(self._rpm.files(), ['/etc/fuse.conf'])
+        self.assertEqual(list(self._rpm.iterfiles()), ['/etc/fuse.conf'])
+
+    def test_fileinfo_columns(self):
+        cols = self._rpm.fileinfo_columns(what=("name", "nlink"))
+        self.assertEqual(cols, {'name': ['/etc/fuse.conf'], 'nlink': [1]})
+
+    def test_fstat_columns(self):
+        cols = self._rpm.fstat_columns()
+        self.assertEqual(list(cols), ['mode', 'ino', 'dev', 'user', 'group',
+                                      'size', 'mtime'])
+        self.assertEqual(list(zip(*cols.values())),
+                         [tuple(s) for s in self._rpm.iterfstat()])
@@ -3,10 +3,11 @@ import re
 import unittest
 from .test_common import TESTDIR
 
-from rpmtoys.vercmp import rpmvercmp
+from rpmtoys.vercmp import rpmvercmp, rpmver_key
+
+vercmpre = re.compile(r'^RPMVERCMP\((\S+), +(\S+), +(\S+)\)')
 
 def iter_rpmvercmp_at():
-    vercmpre = re.compile(r'^RPMVERCMP\((\S+), +(\S+), +(\S+)\)')
     with open(os.path.join(TESTDIR, "rpmvercmp.at")) as inf:
         for line in inf:
             m = vercmpre.match(line)
@@ -19,3 +20,9 @@ class RPMVerCmp(unittest.TestCase):
         for a,b,v in iter_rpmvercmp_at():
             with self.subTest(a=a,b=b,v=v):
                 self.assertEqual(rpmvercmp(a,b), v)
+
+    def test_rpmver_key(self):
+        for a,b,v in iter_rpmvercmp_at():
+            with self.subTest(a=a,b=b,v=v):
+                ka, kb = rpmver_key(a), rpmver_key(b)
+                self.assertEqual((ka > kb) - (ka < kb), v)